@@ -1,2 +1,4 @@
-from transmogrifier.config import Config, MontclairConfig, MontclairiOSConfig, MontclairAndroidConfig
+from transmogrifier.config import Config, MontclairConfig, MontclairiOSConfig, MontclairAndroidConfig, load_config
 from transmogrifier.runner import Runner
+from transmogrifier.batch import Batch
+from transmogrifier.workqueue import WorkQueue, Worker
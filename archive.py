@@ -0,0 +1,175 @@
+# -*- mode: python -*-
+import os
+import zlib
+import struct
+import collections
+import concurrent.futures
+
+# already compressed, so they are stored as is
+STORED = ('.png', '.ico', '.jpg', '.jpeg', '.gif', '.webp', '.avif',
+          '.gz', '.br', '.zip', '.jar', '.woff', '.woff2')
+
+# zip compression methods
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# every entry is dated 1980-01-01 00:00, the earliest a zip can represent
+DOS_TIME = 0
+DOS_DATE = (1 << 5) | 1
+
+# utf-8 names
+FLAGS = 0x800
+
+# sizes, offsets, and entry counts from these on only fit in the zip64
+#  extra fields and end of central directory record
+ZIP64_LIMIT = 0xffffffff
+ZIP64_COUNT_LIMIT = 0xffff
+
+# what the overflowing fields are set to instead
+MAX_32 = 0xffffffff
+MAX_16 = 0xffff
+
+# the version needed to extract, 4.5 for zip64
+VERSION = 20
+VERSION_ZIP64 = 45
+
+# the MS-DOS directory attribute
+DOS_DIRECTORY = 0x10
+
+# An entry, ready to be written
+Entry = collections.namedtuple('Entry', ('name', 'mode', 'method', 'crc', 'size', 'data'))
+
+def entries(path, prefix):
+    # (name, full path) of every file, symlink, and empty directory
+    #  under path, sorted by name
+    found = []
+    for (root, dirs, files) in os.walk(path):
+        if not dirs and not files and root != path:
+            name = os.path.join(prefix, os.path.relpath(root, path)).replace(os.sep, '/')
+            found.append((name + '/', root))
+        for d in dirs:
+            if os.path.islink(os.path.join(root, d)):
+                files.append(d)
+        for f in files:
+            full = os.path.join(root, f)
+            name = os.path.join(prefix, os.path.relpath(full, path)).replace(os.sep, '/')
+            found.append((name, full))
+    return sorted(found)
+
+def compress(name, fname):
+    # read and compress a single entry, this runs on the worker threads
+    if os.path.islink(fname):
+        data = os.readlink(fname).encode('utf-8')
+        mode = 0o120777
+    elif name.endswith('/'):
+        data = b''
+        mode = 0o40755
+    else:
+        with open(fname, 'rb') as f:
+            data = f.read()
+        # normalize the permissions, only keep whether it is executable
+        mode = 0o100755 if os.stat(fname).st_mode & 0o111 else 0o100644
+
+    crc = zlib.crc32(data)
+    size = len(data)
+    if not name.lower().endswith(STORED) and size:
+        c = zlib.compressobj(9, zlib.DEFLATED, -15)
+        compressed = c.compress(data) + c.flush()
+        if len(compressed) < size:
+            return Entry(name, mode, ZIP_DEFLATED, crc, size, compressed)
+    return Entry(name, mode, ZIP_STORED, crc, size, data)
+
+class Archive:
+    # Writes a build tree to a deterministic zip. Entries are sorted, have
+    #  a fixed date, and normalized permissions, so the same tree always
+    #  gives the same bytes. Entries are compressed in parallel (zlib
+    #  releases the GIL), and written in order as they finish.
+    def __init__(self, fname, workers = None):
+        self.fname = fname
+        self.workers = workers or os.cpu_count() or 1
+
+    def write(self, path, prefix = None, only = None):
+        # only is a set of the names (without the prefix) to include
+        prefix = os.path.basename(os.path.normpath(path)) if prefix is None else prefix
+        files = entries(path, prefix)
+        if only is not None:
+            only = set(f'{prefix}/{name}' if prefix else name for name in only)
+            files = [(name, fname) for (name, fname) in files if name in only]
+        tmp = self.fname + '.tmp'
+        try:
+            self.write_entries(tmp, files)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        os.replace(tmp, self.fname)
+        return self.fname
+
+    def write_entries(self, tmp, files):
+        central = []
+        with open(tmp, 'wb') as f, concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            # keep a few entries ahead of the writer, without holding the
+            #  whole tree in memory
+            pending = collections.deque()
+            files = iter(files)
+            while True:
+                while len(pending) < self.workers * 2:
+                    try:
+                        pending.append(pool.submit(compress, *next(files)))
+                    except StopIteration:
+                        break
+                if not pending:
+                    break
+                entry = pending.popleft().result()
+                # only the headers are kept for the central directory
+                central.append((entry._replace(data = None), len(entry.data), f.tell()))
+                self.local_header(f, entry)
+                f.write(entry.data)
+
+            start = f.tell()
+            for (entry, compressed, offset) in central:
+                self.central_header(f, entry, compressed, offset)
+            self.end(f, len(central), start, f.tell() - start)
+
+    def local_header(self, f, entry):
+        name = entry.name.encode('utf-8')
+        sizes = (len(entry.data), entry.size)
+        extra = b''
+        if max(sizes) >= ZIP64_LIMIT:
+            # both sizes go in the extra field, uncompressed first
+            extra = struct.pack('<HHQQ', 0x0001, 16, entry.size, len(entry.data))
+            sizes = (MAX_32, MAX_32)
+        f.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, VERSION_ZIP64 if extra else VERSION, FLAGS,
+                            entry.method, DOS_TIME, DOS_DATE, entry.crc, *sizes, len(name), len(extra)))
+        f.write(name)
+        f.write(extra)
+
+    def central_header(self, f, entry, compressed, offset):
+        name = entry.name.encode('utf-8')
+        # only the fields that overflow go in the extra field, in this order
+        fields = [entry.size, compressed, offset]
+        zip64 = [v for v in fields if v >= ZIP64_LIMIT]
+        extra = struct.pack(f'<HH{len(zip64)}Q', 0x0001, 8 * len(zip64), *zip64) if zip64 else b''
+        (size, compressed, offset) = (MAX_32 if v >= ZIP64_LIMIT else v for v in fields)
+        version = VERSION_ZIP64 if extra else VERSION
+        # made by unix (3), so the permissions in the external attributes
+        #  are used, along with the MS-DOS attributes in the low byte
+        attributes = (entry.mode << 16) | (DOS_DIRECTORY if entry.name.endswith('/') else 0)
+        f.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, FLAGS, entry.method,
+                            DOS_TIME, DOS_DATE, entry.crc, compressed, size, len(name),
+                            len(extra), 0, 0, 0, attributes, offset))
+        f.write(name)
+        f.write(extra)
+
+    def end(self, f, count, start, size):
+        # the end of central directory record, preceded by the zip64 record
+        #  and its locator when anything in it overflows
+        if count >= ZIP64_COUNT_LIMIT or start >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+            offset = f.tell()
+            f.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | VERSION_ZIP64, VERSION_ZIP64,
+                                0, 0, count, count, size, start))
+            f.write(struct.pack('<IIQI', 0x07064b50, 0, offset, 1))
+            count = MAX_16 if count >= ZIP64_COUNT_LIMIT else count
+            start = MAX_32 if start >= ZIP64_LIMIT else start
+            size = MAX_32 if size >= ZIP64_LIMIT else size
+        f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, start, 0))
@@ -0,0 +1,58 @@
+# -*- mode: python -*-
+import os
+
+class AssetPlan:
+    # Every image the runners create, grouped by recipe. The same recipe
+    #  is usually written to several places (app-icon.png and favicon.ico
+    #  by every platform, and the same icon and splash screen sizes under
+    #  different names), so each distinct recipe is rendered once, and the
+    #  other destinations are linked (or copied) from the first one.
+    def __init__(self, raster):
+        self.raster = raster
+        self.groups = {}
+
+    def add(self, images):
+        # images is a list of (recipe, fname)
+        for (recipe, fname) in images:
+            fnames = self.groups.setdefault(recipe, [])
+            if fname not in fnames:
+                fnames.append(fname)
+        return self
+
+    def fnames(self):
+        return [fname for fnames in self.groups.values() for fname in fnames]
+
+    def renders(self):
+        return len(self.groups)
+
+    def deduplicated(self):
+        # the renders we saved by grouping
+        return len(self.fnames()) - self.renders()
+
+    def render(self):
+        # render each group in parallel, then fan it out
+        self.raster.jobs.run([(fnames[0], self.write, (recipe, fnames))
+                              for (recipe, fnames) in self.groups.items()])
+
+    def report(self, platforms):
+        # bytes of the pngs of each platform, platforms is a list of
+        #  (name, images). default is the size without optimizing, which
+        #  is only known for the images rendered by this build, not the
+        #  ones that came from the cache.
+        print(f'{"platform":<10} {"pngs":>5} {"bytes":>10} {"default":>10} {"saved":>6}')
+        for (name, images) in platforms:
+            pngs = [(recipe, fname) for (recipe, fname) in images if recipe.format == 'png']
+            if not pngs:
+                continue
+            size = default = 0
+            for (recipe, fname) in pngs:
+                n = os.path.getsize(fname)
+                size += n
+                default += self.raster.sizes.get(recipe, (n,))[0]
+            saved = 100 * (default - size) / default if default else 0
+            print(f'{name:<10} {len(pngs):>5} {size:>10} {default:>10} {saved:>5.1f}%')
+
+    def write(self, recipe, fnames):
+        self.raster.write(recipe, fnames[0])
+        for fname in fnames[1:]:
+            self.raster.writer.link(fnames[0], fname)
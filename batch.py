@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import argparse
+import collections
+import concurrent.futures
+
+from transmogrifier.config import load_config
+from transmogrifier.runner import Runner, add_build_arguments, cache_from_args
+from transmogrifier.jobs import Jobs
+from transmogrifier.templates import Templates
+from transmogrifier.store import TemplateStore
+from transmogrifier.tracing import Tracer
+from transmogrifier.plan import Plan
+from transmogrifier.delta import Delta
+
+# outcome of building a single tenant, error is None on success
+Result = collections.namedtuple('Result', ('tenant', 'error', 'elapsed'))
+
+class Batch:
+    # Builds many tenants in a single process. The worker pool, the image
+    #  cache, and the parsed templates are shared between all of them.
+    def __init__(self, configs, tenants = 4):
+        # configs is either a list of Config, or a directory of tenant .json files
+        self.configs = configs
+        self.tenants = tenants
+        self.jobs = Jobs()
+        self.cache = None
+        self.templates = Templates()
+        self.force = False
+        self.store = None
+        self.optimize = None
+        self.tracer = None
+        self.plan = None
+        # where --plan saves the plan, - (or None) only reports it
+        self.plan_file = None
+        self.package = None
+        self.delta = None
+        self.precompress = False
+        self.modern_icons = False
+        self.results = []
+
+    def go(self):
+        self.parse_args()
+        self.build()
+        self.summary()
+        if self.tracer:
+            self.tracer.save()
+            self.tracer.summary()
+        if self.plan:
+            self.plan.report()
+            if self.plan_file not in (None, '-'):
+                self.plan.save(self.plan_file)
+
+        if any(r.error for r in self.results):
+            sys.exit(1)
+
+    def parse_args(self, parser = None):
+        parser = parser or argparse.ArgumentParser()
+        parser.add_argument('-t', '--tenants', type = int, default = self.tenants,
+                            help = f'Number of tenants to build at the same time (default: {self.tenants})')
+        add_build_arguments(parser)
+
+        args = parser.parse_args()
+        self.tenants = args.tenants
+        if args.jobs:
+            self.jobs.workers = args.jobs
+        self.cache = cache_from_args(args)
+        self.force = args.force
+        if args.template_store:
+            self.store = TemplateStore(args.template_store)
+        self.optimize = args.optimize_png
+        if args.trace:
+            self.tracer = Tracer(args.trace)
+        if args.plan:
+            self.plan = Plan()
+            self.plan_file = args.plan
+        self.package = args.package
+        if args.delta:
+            self.delta = Delta(args.delta, args.delta_base, self.jobs.workers)
+        self.precompress = args.precompress
+        self.modern_icons = args.modern_icons
+        return args
+
+    def load(self):
+        # returns a list of (tenant, config), where config is None if it
+        #  failed to load, and the error is recorded
+        if not isinstance(self.configs, str):
+            return [(c.repo, c) for c in self.configs]
+
+        configs = []
+        for fname in sorted(os.listdir(self.configs)):
+            if not fname.endswith('.json'):
+                continue
+            try:
+                configs.append((fname, load_config(os.path.join(self.configs, fname))))
+            except Exception as e:
+                self.results.append(Result(fname, e, 0))
+        return configs
+
+    def build(self):
+        self.start = time.time()
+        configs = self.load()
+
+        with concurrent.futures.ThreadPoolExecutor(self.tenants) as pool:
+            for result in pool.map(lambda c: self.build_tenant(*c), configs):
+                self.results.append(result)
+
+        self.elapsed = time.time() - self.start
+        return self.results
+
+    def build_tenant(self, tenant, config):
+        start = time.time()
+        try:
+            Runner(config, self.jobs, self.cache, self.templates, self.force, self.store, self.optimize,
+                   self.tracer, self.plan, self.package, self.delta, self.precompress,
+                   self.modern_icons).build()
+        except Exception as e:
+            return Result(tenant, e, time.time() - start)
+        return Result(tenant, None, time.time() - start)
+
+    def summary(self):
+        width = max([len(r.tenant) for r in self.results] + [6])
+        print()
+        print(f'{"tenant":<{width}}  status  seconds')
+        for r in self.results:
+            status = 'FAILED' if r.error else 'ok'
+            print(f'{r.tenant:<{width}}  {status:<6}  {r.elapsed:7.1f}')
+            if r.error:
+                for line in str(r.error).splitlines():
+                    print(f'{"":<{width}}    {line}')
+
+        failed = len([r for r in self.results if r.error])
+        rate = len(self.results) / self.elapsed * 60 if self.elapsed else 0
+        print()
+        print(f'{len(self.results) - failed} of {len(self.results)} tenants built in {self.elapsed:.1f}s '
+              f'({rate:.1f} tenants/minute)')
+        if self.cache:
+            print(f'image cache: {self.cache.hits} hits, {self.cache.misses} misses')
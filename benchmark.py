@@ -0,0 +1,413 @@
+# -*- mode: python -*-
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from transmogrifier.config import Config, MontclairConfig, MontclairiOSConfig, MontclairAndroidConfig
+from transmogrifier.runner import Runner
+from transmogrifier.runners.web import Web
+from transmogrifier.runners.ios import IOS
+from transmogrifier.runners.android import Android
+from transmogrifier.raster import Raster
+from transmogrifier.jobs import Jobs
+from transmogrifier.templates import Templates
+
+# what we time, each is given a tenant's Config, and the shared Jobs
+#  and Templates (like Batch)
+TARGETS = {
+    'Web.go': lambda config, jobs, templates: Web(config, Raster(config, jobs = jobs), templates).go(),
+    'IOS.go': lambda config, jobs, templates: IOS(config, Raster(config, jobs = jobs), templates).go(),
+    'Android.go': lambda config, jobs, templates: Android(config, Raster(config, jobs = jobs), templates).go(),
+    # Runner.go without the argument parsing
+    'Runner.go': lambda config, jobs, templates: Runner(config, jobs, templates = templates, force = True).build()
+}
+
+WIDGET_XML = '''<?xml version='1.0' encoding='utf-8'?>
+<widget id="net.line72.montclair" version="1.0.0" xmlns="http://www.w3.org/ns/widgets" xmlns:cdv="http://cordova.apache.org/ns/1.0">
+    <name>Montclair</name>
+    <description>Birmingham Transit</description>
+    <author email="line72@line72.net" href="https://line72.net">Marcus Dillavou</author>
+    <content src="https://montclair.line72.net/index.html" />
+    <access origin="*" />
+    <allow-navigation href="https://montclair.line72.net/*" />
+    <allow-intent href="http://*/*" />
+    <allow-intent href="https://*/*" />
+    <platform name="android">
+        <allow-intent href="market:*" />
+        <preference name="AndroidLaunchMode" value="singleTask" />
+    </platform>
+    <platform name="ios">
+        <allow-intent href="itms:*" />
+        <allow-intent href="itms-apps:*" />
+    </platform>
+    <preference name="DisallowOverscroll" value="true" />
+    <plugin name="cordova-plugin-whitelist" spec="1" />
+</widget>
+'''
+
+STRINGS_XML = '''<?xml version='1.0' encoding='utf-8'?>
+<resources>
+    <string name="app_name">Montclair</string>
+    <string name="launcher_name">@string/app_name</string>
+    <string name="activity_name">@string/launcher_name</string>
+</resources>
+'''
+
+ANDROID_MANIFEST = '''<?xml version='1.0' encoding='utf-8'?>
+<manifest android:hardwareAccelerated="true" android:versionCode="10000" android:versionName="1.0.0" package="net.line72.montclair" xmlns:android="http://schemas.android.com/apk/res/android">
+    <supports-screens android:anyDensity="true" android:largeScreens="true" android:normalScreens="true" android:resizeable="true" android:smallScreens="true" android:xlargeScreens="true" />
+    <uses-permission android:name="android.permission.INTERNET" />
+    <application android:hardwareAccelerated="true" android:icon="@mipmap/ic_launcher" android:label="@string/app_name" android:supportsRtl="true">
+        <activity android:label="@string/activity_name" android:launchMode="singleTop" android:name="MainActivity">
+            <intent-filter android:label="@string/launcher_name">
+                <action android:name="android.intent.action.MAIN" />
+                <category android:name="android.intent.category.LAUNCHER" />
+            </intent-filter>
+        </activity>
+    </application>
+</manifest>
+'''
+
+MAIN_ACTIVITY = '''package net.line72.montclair;
+
+import android.os.Bundle;
+import org.apache.cordova.*;
+
+public class MainActivity extends CordovaActivity
+{
+    @Override
+    public void onCreate(Bundle savedInstanceState)
+    {
+        super.onCreate(savedInstanceState);
+        loadUrl(launchUrl);
+    }
+}
+'''
+
+INFO_PLIST = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+    <key>CFBundleDisplayName</key>
+    <string>Montclair</string>
+    <key>CFBundleIdentifier</key>
+    <string>net.line72.montclair</string>
+    <key>NSAppTransportSecurity</key>
+    <dict>
+        <key>NSExceptionDomains</key>
+        <dict>
+            <key>montclair.line72.net</key>
+            <dict/>
+        </dict>
+    </dict>
+</dict>
+</plist>
+'''
+
+INDEX_HTML = '''<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
+    <meta name="apple-itunes-app" content="app-id=1234567890">
+    <meta name="description" content="Birmingham, AL Real Time Bus Tracker">
+    <link rel="manifest" href="%PUBLIC_URL%/manifest.json">
+    <title>Montclair</title>
+  </head>
+  <body>
+    <div id="root"></div>
+  </body>
+</html>
+'''
+
+FIRST_RUN_HINT_JS = '''import React, { Component } from 'react';
+
+class FirstRunHint extends Component {
+    render() {
+        return (
+            <div className="FirstRunHint">Welcome to Birmingham, tap a route to get started.</div>
+        );
+    }
+}
+
+export default FirstRunHint;
+'''
+
+HEADER_JS = '''import React, { Component } from 'react';
+
+class Header extends Component {
+    render() {
+        return (<h1>Birmingham Transit</h1>);
+    }
+}
+'''
+
+LOGO_SVG = '''<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 512 512">
+  <rect width="512" height="512" rx="64" fill="#1e5aa8"/>
+  <circle cx="256" cy="220" r="140" fill="#ffffff"/>
+  <path d="M176 200h160v80h-160z" fill="#1e5aa8"/>
+  <circle cx="206" cy="320" r="24" fill="#ffd23f"/>
+  <circle cx="306" cy="320" r="24" fill="#ffd23f"/>
+</svg>
+'''
+
+def package_lock(dependencies):
+    # a package-lock.json about the size of montclair's
+    return {
+        'name': 'montclair',
+        'version': '1.0.0',
+        'lockfileVersion': 1,
+        'requires': True,
+        'dependencies': {
+            f'package-{i}': {
+                'version': f'{i % 7}.{i % 13}.{i % 5}',
+                'resolved': f'https://registry.npmjs.org/package-{i}/-/package-{i}-{i % 7}.{i % 13}.{i % 5}.tgz',
+                'integrity': f'sha512-{i:064x}',
+                'dev': i % 3 == 0,
+                'requires': {f'package-{j}': f'^{j % 7}.0.0' for j in range(i + 1, min(i + 4, dependencies))}
+            } for i in range(dependencies)
+        }
+    }
+
+def manifest(url):
+    return {
+        'short_name': 'Montclair',
+        'name': 'Montclair',
+        'description': 'Birmingham Transit',
+        'icons': [
+            {'src': f'{url}/favicon.ico', 'sizes': '64x64 32x32 24x24 16x16', 'type': 'image/x-icon'},
+            {'src': f'{url}/app-icon.png', 'sizes': '512x512', 'type': 'image/png'}
+        ],
+        'start_url': './index.html',
+        'display': 'standalone',
+        'theme_color': '#000000',
+        'background_color': '#ffffff'
+    }
+
+class Fixture:
+    # Writes fake montclair, montclair-pwa-ios and montclair-pwa-android
+    #  base projects, with every file the runners edit, in the layout the
+    #  runners expect.
+    def __init__(self, path, dependencies = 1500):
+        self.path = path
+        self.dependencies = dependencies
+
+    def write(self, fname, contents):
+        fname = os.path.join(self.path, fname)
+        os.makedirs(os.path.dirname(fname), exist_ok = True)
+        with open(fname, 'w') as f:
+            f.write(contents if isinstance(contents, str) else json.dumps(contents, indent = 2) + '\n')
+
+    def create(self):
+        url = 'https://montclair.line72.net'
+        lock = package_lock(self.dependencies)
+
+        # montclair
+        self.write('montclair/README.md', '# Montclair\n')
+        self.write('montclair/package.json', {'name': 'montclair', 'version': '1.0.0', 'private': True,
+                                              'dependencies': {k: '^' + v['version'] for (k, v) in lock['dependencies'].items()}})
+        self.write('montclair/package-lock.json', lock)
+        self.write('montclair/public/manifest.json', manifest(url))
+        self.write('montclair/public/index.html', INDEX_HTML)
+        self.write('montclair/src/FirstRunHint.js', FIRST_RUN_HINT_JS)
+        self.write('montclair/src/AgencyList.js', HEADER_JS)
+        self.write('montclair/src/ExploreContainer.js', HEADER_JS)
+        self.write('montclair/src/Configuration.js', 'export default {};\n')
+
+        # montclair-pwa-ios and montclair-pwa-android
+        for (kind, www) in (('ios', 'platforms/ios/www'), ('android', 'platforms/android/app/src/main/assets/www')):
+            tree = f'montclair-pwa-{kind}'
+            self.write(f'{tree}/package.json', {'name': 'montclair', 'displayName': 'Montclair', 'version': '1.0.0'})
+            self.write(f'{tree}/package-lock.json', lock)
+            self.write(f'{tree}/config.xml', WIDGET_XML)
+            self.write(f'{tree}/generationInfo.json', {'generatedURL': f'{url}/manifest.json', 'platform': kind})
+            self.write(f'{tree}/plugins/{kind}.json', {'installed_plugins': {'cordova-plugin-whitelist': {'PACKAGE_NAME': 'net.line72.montclair'}}})
+            for m in ('manifest.json', 'www/manifest.json', f'{www}/manifest.json'):
+                self.write(f'{tree}/{m}', manifest(url))
+
+        ios = 'montclair-pwa-ios'
+        self.write(f'{ios}/platforms/ios/Montclair/config.xml', WIDGET_XML)
+        self.write(f'{ios}/platforms/ios/Montclair/Montclair-Info.plist', INFO_PLIST)
+        self.write(f'{ios}/platforms/ios/ios.json', {'installed_plugins': {'cordova-plugin-whitelist': {'PACKAGE_NAME': 'net.line72.montclair'}}})
+        self.write(f'{ios}/platforms/ios/generationInfo.json', {'generatedURL': f'{url}/manifest.json', 'platform': 'ios'})
+        self.write(f'{ios}/www/index.html', INDEX_HTML)
+        for d in ('AppIcon.appiconset', 'LaunchImage.launchimage'):
+            os.makedirs(os.path.join(self.path, ios, 'platforms/ios/Montclair/Images.xcassets', d), exist_ok = True)
+
+        android = 'montclair-pwa-android'
+        main = f'{android}/platforms/android/app/src/main'
+        self.write(f'{android}/platforms/android/android.json', {'installed_plugins': {'cordova-plugin-whitelist': {'PACKAGE_NAME': 'net.line72.montclair'}}})
+        self.write(f'{main}/res/xml/config.xml', WIDGET_XML)
+        self.write(f'{main}/res/values/strings.xml', STRINGS_XML)
+        self.write(f'{main}/AndroidManifest.xml', ANDROID_MANIFEST)
+        self.write(f'{main}/java/net/line72/montclair/MainActivity.java', MAIN_ACTIVITY)
+        for dpi in ('ldpi', 'mdpi', 'hdpi', 'xhdpi', 'xxhdpi', 'xxxhdpi'):
+            for d in (f'mipmap-{dpi}', f'mipmap-{dpi}-v26'):
+                os.makedirs(os.path.join(self.path, main, 'res', d), exist_ok = True)
+
+        self.write('logo.svg', LOGO_SVG)
+        self.write('Configuration.js', 'export default {\n    agencies: []\n};\n')
+
+    def tenant(self, build_dir, i):
+        # a tenant, with its own copies of the base projects in build_dir
+        repo = f'tenant{i}'
+        for kind in ('montclair', 'montclair-pwa-ios', 'montclair-pwa-android'):
+            tree = kind.replace('montclair', f'montclair-{repo}', 1)
+            shutil.copytree(os.path.join(self.path, kind), os.path.join(build_dir, tree))
+
+        return Config(
+            build_dir = build_dir,
+            repo = repo,
+            package_name = f'montclair-{repo}',
+            name = f'Tenant {i}',
+            description = f'Real time Bus Tracker for tenant {i}',
+            url = f'https://{repo}.montclair.line72.net',
+            logo_svg = os.path.join(self.path, 'logo.svg'),
+            montclair_config = MontclairConfig(
+                version = '1.0.0',
+                title = f'Tenant {i} Transit',
+                first_run_text = f'Welcome to tenant {i}',
+                configuration_js_file = os.path.join(self.path, 'Configuration.js')
+            ),
+            ios_config = MontclairiOSConfig(
+                app_id = f'net.line72.montclair.{repo}',
+                app_store_id = str(1000000000 + i),
+                app_store_url = f'https://apps.apple.com/app/id{1000000000 + i}'
+            ),
+            android_config = MontclairAndroidConfig(
+                app_id = f'net.line72.montclair.{repo}',
+                play_store_url = f'https://play.google.com/store/apps/details?id=net.line72.montclair.{repo}'
+            )
+        )
+
+class Benchmark:
+    # Times each runner, and a full build, for a number of tenants built
+    #  one after another from fresh copies of a synthetic fixture. The
+    #  results are saved as json, and can be compared to an earlier run.
+    def __init__(self, tenants = (1, 10, 100), targets = tuple(TARGETS)):
+        self.tenants = tenants
+        self.targets = targets
+        self.output = 'benchmark.json'
+        self.compare = None
+        self.work_dir = None
+        self.dependencies = 1500
+        self.jobs = Jobs()
+        self.results = []
+
+    def go(self):
+        self.parse_args()
+        self.run()
+        self.save()
+        self.summary()
+
+    def parse_args(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-t', '--tenants', default = ','.join(str(n) for n in self.tenants),
+                            help = 'Comma separated numbers of tenants to build (default: %(default)s)')
+        parser.add_argument('--targets', default = ','.join(self.targets),
+                            help = 'Comma separated things to time (default: %(default)s)')
+        parser.add_argument('-o', '--output', default = self.output,
+                            help = 'Write the results to this json file (default: %(default)s)')
+        parser.add_argument('-c', '--compare',
+                            help = 'Compare against the results of an earlier run')
+        parser.add_argument('-w', '--work-dir',
+                            help = 'Build in this directory, and keep it (default: a temporary directory)')
+        parser.add_argument('--dependencies', type = int, default = self.dependencies,
+                            help = 'Number of packages in the fake package-lock.json (default: %(default)s)')
+        parser.add_argument('-j', '--jobs', type = int,
+                            help = 'Number of steps and images to run in parallel (default: number of cores)')
+
+        args = parser.parse_args()
+        self.tenants = [int(n) for n in args.tenants.split(',')]
+        self.targets = args.targets.split(',')
+        for target in self.targets:
+            if target not in TARGETS:
+                raise Exception(f'Benchmark: Unknown target {target}, expected one of {", ".join(TARGETS)}')
+        self.output = args.output
+        self.compare = args.compare
+        self.work_dir = args.work_dir
+        self.dependencies = args.dependencies
+        if args.jobs:
+            self.jobs.workers = args.jobs
+
+    def run(self):
+        work_dir = self.work_dir or tempfile.mkdtemp(prefix = 'transmogrifier-benchmark-')
+        try:
+            fixture = Fixture(os.path.join(work_dir, 'fixture'), self.dependencies)
+            fixture.create()
+            for n in self.tenants:
+                for target in self.targets:
+                    self.results.append(self.time(fixture, os.path.join(work_dir, f'{target}-{n}'), target, n))
+        finally:
+            if self.work_dir is None:
+                shutil.rmtree(work_dir, ignore_errors = True)
+        return self.results
+
+    def time(self, fixture, build_dir, target, n):
+        # copying the base projects isn't part of the time
+        shutil.rmtree(build_dir, ignore_errors = True)
+        configs = [fixture.tenant(build_dir, i) for i in range(n)]
+        templates = Templates()
+
+        print(f'{target} x {n}', file = sys.stderr)
+        start = time.time()
+        cpu = time.process_time()
+        for config in configs:
+            TARGETS[target](config, self.jobs, templates)
+        elapsed = time.time() - start
+        cpu = time.process_time() - cpu
+
+        if self.work_dir is None:
+            shutil.rmtree(build_dir, ignore_errors = True)
+        return {
+            'target': target,
+            'tenants': n,
+            'seconds': elapsed,
+            'cpu': cpu,
+            'per_tenant': elapsed / n
+        }
+
+    def save(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                    stdout = subprocess.PIPE, stderr = subprocess.DEVNULL,
+                                    check = True).stdout.decode('utf-8').strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        with open(self.output, 'w') as f:
+            json.dump({
+                'commit': commit,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'workers': self.jobs.workers,
+                'dependencies': self.dependencies,
+                'results': self.results
+            }, f, indent = 2)
+            f.write('\n')
+
+    def summary(self):
+        previous = {}
+        if self.compare:
+            with open(self.compare) as f:
+                previous = {(r['target'], r['tenants']): r for r in json.load(f)['results']}
+
+        print()
+        print(f'{"target":<12} {"tenants":>7} {"seconds":>9} {"cpu":>9} {"per tenant":>10}' +
+              (f' {"before":>9} {"change":>7}' if previous else ''))
+        for r in self.results:
+            line = f'{r["target"]:<12} {r["tenants"]:>7} {r["seconds"]:9.2f} {r["cpu"]:9.2f} {r["per_tenant"]:10.3f}'
+            before = previous.get((r['target'], r['tenants']))
+            if before:
+                change = 100 * (r['seconds'] - before['seconds']) / before['seconds'] if before['seconds'] else 0
+                line += f' {before["seconds"]:9.2f} {change:+6.1f}%'
+            print(line)
+        print(f'results written to {self.output}')
@@ -0,0 +1,120 @@
+# -*- mode: python -*-
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# an empty file next to each entry, whose mtime is when it was last used.
+#  Entries are hardlinked into the build trees, so touching the entry
+#  itself would change the mtime of their files too.
+USED = '.used'
+
+class Cache:
+    # A content addressed cache of rendered images. Entries are keyed by
+    #  the hash of the logo and the recipe used to render it, and the
+    #  least recently used entries are evicted once max_size is reached.
+    def __init__(self, path, max_size = 512 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts):
+        h = hashlib.sha256()
+        for p in parts:
+            h.update(p if isinstance(p, bytes) else repr(p).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def fetch(self, key, fname, link = None):
+        # link (or copy) a cached entry to fname, returns False on a miss.
+        #  link(src, fname) can replace how it is linked.
+        e = self.entry(key)
+        try:
+            (link or self.link)(e, fname)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+
+        self.touch(key)
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def touch(self, key):
+        # mark the entry as the most recently used
+        with open(self.entry(key) + USED, 'a'):
+            pass
+        os.utime(self.entry(key) + USED)
+
+    def store(self, key, data, fname = None, link = None):
+        # add an entry, and optionally link it to fname
+        e = self.entry(key)
+        os.makedirs(os.path.dirname(e), exist_ok = True)
+
+        # write to a temporary file and rename it, so other
+        #  builds sharing this cache never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(e))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, e)
+        self.touch(key)
+        if fname:
+            (link or self.link)(e, fname)
+
+        with self.lock:
+            if self.size is not None:
+                self.size += len(data)
+            self.evict()
+
+    def link(self, src, fname):
+        if os.path.lexists(fname):
+            os.unlink(fname)
+        try:
+            os.link(src, fname)
+        except OSError:
+            # different filesystems, or no hardlink support
+            shutil.copyfile(src, fname)
+
+    def entries(self):
+        for d in os.scandir(self.path):
+            if d.is_dir():
+                for e in os.scandir(d.path):
+                    if e.is_file() and not e.name.endswith(USED):
+                        yield e
+
+    def evict(self):
+        if not os.path.isdir(self.path):
+            return
+
+        if self.size is None:
+            self.size = sum(e.stat().st_size for e in self.entries())
+        if self.size <= self.max_size:
+            return
+
+        # remove the least recently used entries until we are under the cap
+        for e in sorted(self.entries(), key = self.used):
+            if self.size <= self.max_size:
+                break
+            self.size -= e.stat().st_size
+            for fname in (e.path, e.path + USED):
+                try:
+                    os.unlink(fname)
+                except FileNotFoundError:
+                    # already evicted by another build
+                    pass
+
+    def used(self, e):
+        # when an entry was last used, entries from before USED by their mtime
+        try:
+            return os.stat(e.path + USED).st_mtime
+        except FileNotFoundError:
+            return e.stat().st_mtime
@@ -1,3 +1,6 @@
+import os
+import json
+
 
 class Config:
     def __init__(self,
@@ -22,6 +25,8 @@ class Config:
         self.montclair_config = montclair_config
         self.ios_config = ios_config
         self.android_config = android_config
+        # the json file this was loaded from, see load_config
+        self.fname = None
 
 class MontclairConfig:
     def __init__(self,
@@ -56,9 +61,56 @@ class MontclairAndroidConfig:
                  version = '1.0.0', # version of montclair-pwa-android to build from
                  revision = 1, # output revision of whitelabel build
                  app_id = 'net.line72.montclair.whitelabel',
-                 play_store_url = '' # URL to the play store
+                 play_store_url = '', # URL to the play store
+                 vector_icons = False # adaptive icon layers as vector drawables, instead of pngs
     ):
         self.version = version
         self.revision = revision
         self.app_id = app_id
         self.play_store_url = play_store_url
+        self.vector_icons = vector_icons
+
+def config_to_dict(config):
+    # the inverse of config_from_dict, for serializing a Config
+    c = {k: v for (k, v) in vars(config).items() if k != 'fname'}
+    for k in ('montclair_config', 'ios_config', 'android_config'):
+        if c[k] is not None:
+            c[k] = dict(vars(c[k]))
+    return c
+
+def config_from_dict(c):
+    # A Config from a dict, like the contents of a tenant's json file.
+    #  The montclair, ios, and android sections are optional.
+    c = dict(c)
+    montclair_config = c.pop('montclair_config', None)
+    ios_config = c.pop('ios_config', None)
+    android_config = c.pop('android_config', None)
+
+    if montclair_config is not None:
+        montclair_config = MontclairConfig(**montclair_config)
+    if ios_config is not None:
+        ios_config = MontclairiOSConfig(**ios_config)
+    if android_config is not None:
+        android_config = MontclairAndroidConfig(**android_config)
+
+    return Config(montclair_config = montclair_config,
+                  ios_config = ios_config,
+                  android_config = android_config,
+                  **c)
+
+def load_config(fname):
+    # Load a tenant's Config from a json file, relative paths are
+    #  relative to the json file.
+    with open(fname) as f:
+        config = config_from_dict(json.load(f))
+
+    base = os.path.dirname(os.path.abspath(fname))
+    def path(p):
+        return os.path.join(base, p) if p else p
+
+    if config.montclair_config is not None:
+        config.montclair_config.configuration_js_file = path(config.montclair_config.configuration_js_file)
+    config.build_dir = path(config.build_dir)
+    config.logo_svg = path(config.logo_svg)
+    config.fname = os.path.abspath(fname)
+    return config
@@ -0,0 +1,77 @@
+# -*- mode: python -*-
+import os
+import json
+import hashlib
+import concurrent.futures
+
+from transmogrifier.archive import Archive, entries
+
+def digest(name, fname):
+    # what identifies an entry of a build tree, the permissions matter too
+    if os.path.islink(fname):
+        return 'link:' + hashlib.sha256(os.readlink(fname).encode('utf-8')).hexdigest()
+    if name.endswith('/'):
+        return 'dir'
+
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    mode = '755' if os.stat(fname).st_mode & 0o111 else '644'
+    return f'{mode}:{h.hexdigest()}'
+
+def manifest(path, workers = None):
+    # {name: digest} of every entry of a build tree
+    files = entries(path, '')
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        digests = list(pool.map(lambda f: digest(*f), files))
+    return {name: d for ((name, fname), d) in zip(files, digests)}
+
+class Delta:
+    # Writes, for each build tree, only what changed since a previous
+    #  build. Every build leaves a manifest of the hashes of its files
+    #  in path, which is the base of the next build's delta, unless
+    #  another base directory is given.
+    #
+    #  {tree}.manifest.json - the hash of every file in the tree
+    #  {tree}.delta.zip     - the files that are new or changed
+    #  {tree}.delta.json    - the changed and deleted files
+    def __init__(self, path, base = None, workers = None):
+        self.path = path
+        self.base = base or path
+        self.workers = workers
+
+    def write(self, tree):
+        name = os.path.basename(os.path.normpath(tree))
+        current = manifest(tree, self.workers)
+        try:
+            with open(os.path.join(self.base, f'{name}.manifest.json')) as f:
+                previous = json.load(f)
+            base = hashlib.sha256(json.dumps(previous, sort_keys = True).encode('utf-8')).hexdigest()
+        except FileNotFoundError:
+            # nothing to compare to, everything is new
+            previous = {}
+            base = None
+
+        changed = sorted(n for (n, d) in current.items() if previous.get(n) != d)
+        deleted = sorted(n for n in previous if n not in current)
+        # an empty directory that now has files in it isn't deleted
+        deleted = [n for n in deleted if not n.endswith('/') or not any(c.startswith(n) for c in current)]
+
+        os.makedirs(self.path, exist_ok = True)
+        Archive(os.path.join(self.path, f'{name}.delta.zip'), self.workers).write(tree, name, changed)
+        self.save(f'{name}.delta.json', {
+            'tree': name,
+            'base': base,
+            'changed': changed,
+            'deleted': deleted
+        })
+        self.save(f'{name}.manifest.json', current)
+        return (changed, deleted)
+
+    def save(self, fname, data):
+        tmp = os.path.join(self.path, fname + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent = 2, sort_keys = True)
+            f.write('\n')
+        os.replace(tmp, os.path.join(self.path, fname))
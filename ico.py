@@ -0,0 +1,44 @@
+# -*- mode: python -*-
+import struct
+
+from PIL import Image
+
+# layers this big or bigger are stored as png, smaller ones as bitmaps,
+#  which every reader understands
+PNG_SIZE = 64
+
+def bitmap(img):
+    # a 32 bit BGRA DIB, bottom up, followed by the 1 bit AND mask
+    img = img.convert('RGBA')
+    w, h = img.size
+    flipped = img.transpose(Image.FLIP_TOP_BOTTOM)
+    pixels = flipped.tobytes('raw', 'BGRA')
+
+    # the mask is set wherever the image is fully transparent, padded
+    #  to 32 bits per row
+    alpha = flipped.getchannel('A').tobytes()
+    stride = (w + 31) // 32 * 4
+    mask = bytearray(stride * h)
+    for y in range(h):
+        for x in range(w):
+            if alpha[y * w + x] == 0:
+                mask[y * stride + x // 8] |= 0x80 >> (x % 8)
+
+    # the height covers the image and the mask
+    header = struct.pack('<IiiHHIIiiII', 40, w, h * 2, 1, 32, 0, len(pixels) + len(mask), 0, 0, 0, 0)
+    return header + pixels + bytes(mask)
+
+def encode(layers):
+    # layers is a list of (size, data), where data is either the png
+    #  encoded layer, or an Image to store as a bitmap
+    data = [layer if isinstance(layer, bytes) else bitmap(layer) for (size, layer) in layers]
+
+    header = struct.pack('<HHH', 0, 1, len(layers))
+    offset = len(header) + 16 * len(layers)
+    entries = b''
+    for ((size, layer), d) in zip(layers, data):
+        # 0 means 256
+        dim = size if size < 256 else 0
+        entries += struct.pack('<BBBBHHII', dim, dim, 0, 0, 1, 32, len(d), offset)
+        offset += len(d)
+    return header + entries + b''.join(data)
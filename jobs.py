@@ -0,0 +1,71 @@
+# -*- mode: python -*-
+import os
+import collections
+import concurrent.futures
+
+from transmogrifier.tracing import propagate
+
+# A build step, the files it reads and writes, and the config fields it uses
+Step = collections.namedtuple('Step', ('name', 'fn', 'reads', 'writes', 'fields'))
+
+class Jobs:
+    # Runs independent jobs on a bounded pool of worker threads
+    def __init__(self, workers = None):
+        self.workers = workers or os.cpu_count() or 1
+
+    def run(self, jobs):
+        # jobs is a list of (target, function, args). Every job is run,
+        #  and any failures are reported together with their target
+        failures = []
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            futures = {pool.submit(propagate(fn), *args): target for (target, fn, args) in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append((futures[future], e))
+
+        if failures:
+            failures.sort(key = lambda x: x[0])
+            lines = '\n'.join(f'  {target}: {e}' for (target, e) in failures)
+            raise Exception(f'Jobs: {len(failures)} of {len(jobs)} jobs failed\n{lines}')
+
+    def run_steps(self, steps, keep_going = False):
+        # Runs steps concurrently, while keeping them in order wherever
+        #  they touch the same files. A step waits for every earlier step
+        #  that writes a file it reads or writes, or reads a file it writes.
+        #  Nothing new is started after a failure, unless keep_going, in
+        #  which case only the steps waiting on a failed step are skipped.
+        reads = [set(os.path.abspath(f) for f in step.reads) for step in steps]
+        writes = [set(os.path.abspath(f) for f in step.writes) for step in steps]
+        deps = {}
+        for i in range(len(steps)):
+            deps[i] = set(j for j in range(i)
+                          if writes[j] & (reads[i] | writes[i]) or reads[j] & writes[i])
+
+        done = set()
+        failures = []
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            running = {}
+            while True:
+                # start everything that is ready
+                if not failures or keep_going:
+                    for i in sorted(deps):
+                        if deps[i] <= done:
+                            del deps[i]
+                            running[pool.submit(steps[i].fn)] = i
+                if not running:
+                    break
+
+                finished, _ = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(i)
+                    except Exception as e:
+                        failures.append((steps[i].name, e))
+
+        if failures:
+            lines = '\n'.join(f'  {name}: {e}' for (name, e) in failures)
+            raise Exception(f'Jobs: {len(failures)} steps failed\n{lines}')
@@ -0,0 +1,182 @@
+# -*- mode: python -*-
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from transmogrifier.store import detach
+
+def file_hash(fname):
+    # sha256 of a file, or None if it doesn't exist
+    try:
+        with open(fname, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def config_value(config, field):
+    # look up a dotted field, like montclair_config.title
+    value = config
+    for name in field.split('.'):
+        value = getattr(value, name, None) if value is not None else None
+    return value
+
+class Ledger:
+    # Records, for every step, a fingerprint of the config fields and the
+    #  files it consumed, and the hashes of the files it produced. A step
+    #  is skipped when nothing it depends on has changed since it last ran.
+    #
+    # Most steps edit template files in place, so the pristine version of
+    #  every file a step edits is kept. When a step has to run again, its
+    #  files are first put back the way they were in the template (or
+    #  with a writer, read from the stash until they are written again).
+    def __init__(self, config, force = False, writer = None):
+        self.config = config
+        self.force = force
+        # when set, the files a step is about to write aren't put back,
+        #  they are read from the stash, see Writer.redirect
+        self.writer = writer
+        self.path = os.path.join(config.build_dir, '.transmogrifier')
+        self.fname = os.path.join(self.path, f'{config.repo}.json')
+        self.lock = threading.Lock()
+        self.skipped = []
+        self.ran = []
+        try:
+            with open(self.fname) as f:
+                self.steps = json.load(f)
+        except FileNotFoundError:
+            self.steps = {}
+
+    def save(self):
+        os.makedirs(self.path, exist_ok = True)
+        with self.lock:
+            fd, tmp = tempfile.mkstemp(dir = self.path)
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(self.steps, indent = 2, sort_keys = True))
+                f.write('\n')
+            os.replace(tmp, self.fname)
+
+    def wrap(self, step):
+        return step._replace(fn = lambda: self.run(step))
+
+    def fingerprint(self, step):
+        # a field is either a dotted config field, or a (name, value) for
+        #  settings that aren't part of the config
+        values = [f if isinstance(f, tuple) else (f, config_value(self.config, f)) for f in step.fields]
+        h = hashlib.sha256(json.dumps([values, sorted(step.reads), sorted(step.writes)], default = str).encode('utf-8'))
+        return h.hexdigest()
+
+    def unchanged(self, step, entry, fingerprint):
+        if self.force or entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        # files we only read, like the logo, must be the same
+        for (fname, h) in entry['inputs'].items():
+            if fname not in entry['outputs'] and file_hash(fname) != h:
+                return False
+        # and nobody else has touched what we wrote
+        for (fname, h) in entry['outputs'].items():
+            if file_hash(fname) != h:
+                return False
+        return True
+
+    def run(self, step):
+        with self.lock:
+            entry = self.steps.get(step.name)
+        fingerprint = self.fingerprint(step)
+        if self.unchanged(step, entry, fingerprint):
+            with self.lock:
+                self.skipped.append(step.name)
+            return
+
+        inputs = self.restore(step, entry)
+        try:
+            step.fn()
+        finally:
+            left = self.writer.release(step.writes) if self.writer else {}
+        # the step didn't write them this time, so they go back to the template
+        for (fname, p) in left.items():
+            self.copy(p, fname)
+        outputs = {fname: file_hash(fname) for fname in step.writes}
+        with self.lock:
+            self.steps[step.name] = {
+                'fingerprint': fingerprint,
+                'inputs': inputs,
+                'outputs': outputs
+            }
+            self.ran.append(step.name)
+
+    def restore(self, step, entry):
+        # Puts back every file we edited the last time this step ran, and
+        #  returns the hash of each input as it was in the template. A file
+        #  is only ours if it still has the contents we gave it, anything
+        #  else is a fresh template (or was only read), and is kept as is.
+        previous = entry or {'inputs': {}, 'outputs': {}}
+
+        for (fname, h) in previous['outputs'].items():
+            if previous['inputs'].get(fname) or fname in step.writes or h is None:
+                # put back below, or still ours
+                continue
+            if file_hash(fname) == h:
+                # something we created that we won't write this time,
+                #  like MainActivity.java under an old app_id
+                try:
+                    os.unlink(fname)
+                    os.removedirs(os.path.dirname(fname))
+                except OSError:
+                    # already gone, or the directory isn't empty
+                    pass
+
+        inputs = {}
+        for fname in sorted(set(step.reads) | set(previous['inputs'])):
+            current = file_hash(fname)
+            original = previous['inputs'].get(fname)
+            ours = fname in previous['outputs'] and current == previous['outputs'][fname]
+            if original and ours:
+                if self.writer and fname in step.writes and current:
+                    # leave the file alone, if the step writes the same
+                    #  thing again it keeps its mtime. Files we moved
+                    #  away still have to be put back.
+                    self.writer.redirect(fname, self.stashed(original))
+                else:
+                    self.unstash(original, fname)
+                current = original
+            elif current and fname in step.writes:
+                # a pristine template that we are about to edit
+                self.stash(current, fname)
+
+            if fname in step.reads:
+                inputs[fname] = current
+        return inputs
+
+    def pristine(self, fname):
+        # where the template version of a file we edited can be read from,
+        #  or None if it is still the template (or we don't know about it)
+        for entry in self.steps.values():
+            original = entry['inputs'].get(fname)
+            if original and fname in entry['outputs'] and file_hash(fname) == entry['outputs'][fname]:
+                p = self.stashed(original)
+                if os.path.exists(p):
+                    return p
+        return None
+
+    def stash(self, h, fname):
+        p = self.stashed(h)
+        if not os.path.exists(p):
+            os.makedirs(os.path.dirname(p), exist_ok = True)
+            fd, tmp = tempfile.mkstemp(dir = os.path.dirname(p))
+            os.close(fd)
+            shutil.copyfile(fname, tmp)
+            os.replace(tmp, p)
+
+    def stashed(self, h):
+        return os.path.join(self.path, 'pristine', h)
+
+    def unstash(self, h, fname):
+        self.copy(self.stashed(h), fname)
+
+    def copy(self, p, fname):
+        os.makedirs(os.path.dirname(fname), exist_ok = True)
+        detach(fname)
+        shutil.copyfile(p, fname)
@@ -0,0 +1,38 @@
+# -*- mode: python -*-
+import urllib.parse
+
+# The manifest.json edits shared by the runners. These are applied to a
+#  template once by Templates.json, so they must only assign values.
+
+def web_manifest(m, v):
+    # public/manifest.json in montclair
+    m['short_name'] = v['name']
+    m['name'] = v['name']
+    m['description'] = v['description']
+    m['related_applications'] = v['related_applications']
+
+def pwa_manifest(m, v):
+    # the manifest.json copies in montclair-pwa-ios and montclair-pwa-android
+    m['short_name'] = v['name']
+    m['name'] = v['name']
+    m['description'] = v['description']
+    m['start_url'] = v['url'] + '/index.html'
+
+    # fix all the icons
+    for icon in m['icons']:
+        url = urllib.parse.urlparse(icon['src'])
+        icon['src'] = f"{v['url']}{url.path}"
+
+def write_manifests(runner, fnames, edit, values):
+    # The copies of manifest.json are usually identical, so group them by
+    #  their contents, transform each distinct document once, and write
+    #  the same output to every copy.
+    documents = {}
+    for fname in fnames:
+        documents.setdefault(runner.oread(fname), []).append(fname)
+
+    for (text, copies) in documents.items():
+        m = runner.templates.json(text, edit, values)
+        for fname in copies:
+            with runner.o(fname, 'w') as f:
+                f.write(m)
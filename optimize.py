@@ -0,0 +1,52 @@
+# -*- mode: python -*-
+import io
+import zlib
+
+from PIL import Image, ImageChops
+
+# zlib strategies to try, the best one depends on the image. Flat
+#  splash screens usually favor RLE, and detailed icons the filtered one.
+STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)
+
+# --optimize-png modes
+MODES = ('lossless', 'palette')
+
+def encode(img, **kwargs):
+    # icc_profile = None drops any profile carried over from the master,
+    #  and nothing else (text, time, exif) is written unless asked for
+    b = io.BytesIO()
+    img.save(b, format = 'PNG', icc_profile = None, **kwargs)
+    return b.getvalue()
+
+def reduce(img):
+    # the smallest color type that holds img without losing anything
+    alpha = img.mode == 'RGBA'
+    if alpha and img.getchannel('A').getextrema()[0] == 255:
+        # fully opaque
+        img = img.convert('RGB')
+        alpha = False
+
+    r, g, b = img.getchannel('R'), img.getchannel('G'), img.getchannel('B')
+    if ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(r, b).getbbox() is None:
+        # grayscale
+        img = Image.merge('LA', (r, img.getchannel('A'))) if alpha else r
+    return img
+
+def png(img, mode = 'lossless'):
+    # Returns (default, optimized), img encoded with the default settings
+    #  and the smallest encoding we could find. lossless tries the color
+    #  types and zlib strategies, palette also quantizes to 256 colors,
+    #  which is lossy, but usually halves the size of an icon.
+    default = encode(img)
+    candidates = [reduce(img)]
+    if mode == 'palette':
+        method = Image.Quantize.FASTOCTREE if img.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+        candidates.append(img.quantize(256, method = method))
+
+    best = default
+    for c in candidates:
+        for strategy in STRATEGIES:
+            data = encode(c, compress_level = 9, compress_type = strategy)
+            if len(data) < len(best):
+                best = data
+    return (default, best)
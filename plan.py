@@ -0,0 +1,106 @@
+# -*- mode: python -*-
+import io
+import os
+import json
+import hashlib
+import threading
+
+class Buffer(io.BytesIO):
+    # a file being written to the plan, it is recorded when closed
+    def __init__(self, plan, fname):
+        super().__init__()
+        self.plan = plan
+        self.fname = fname
+
+    def close(self):
+        if not self.closed:
+            self.plan.write(self.fname, self.getvalue())
+        super().close()
+
+class Plan:
+    # Everything a build would do, without doing it. Files are read from
+    #  the build trees (or their pristine versions, see sources), and
+    #  writes, removes, and image renders are kept in memory. A plan can be
+    #  shared by many tenants, since they all have their own build trees.
+    def __init__(self):
+        self.files = {}
+        self.writes = {}
+        self.removes = []
+        self.renders = []
+        # functions of a path to where its pristine contents can be read
+        #  from, or None if they don't know about it
+        self.sources = []
+        self.lock = threading.Lock()
+
+    def source(self, fname):
+        for source in self.sources:
+            p = source(fname)
+            if p is not None:
+                return p
+        return fname
+
+    def exists(self, fname):
+        with self.lock:
+            if fname in self.files:
+                return self.files[fname] is not None
+        return os.path.exists(self.source(fname))
+
+    def read(self, fname):
+        with self.lock:
+            if fname in self.files:
+                if self.files[fname] is None:
+                    raise FileNotFoundError(f'{fname} was moved')
+                return self.files[fname]
+        with open(self.source(fname), 'rb') as f:
+            return f.read()
+
+    def write(self, fname, data):
+        with self.lock:
+            self.files[fname] = data
+            self.writes[fname] = hashlib.sha256(data).hexdigest()
+
+    def open(self, fname, mode = 'r'):
+        # the same as open(fname, mode), for the modes the runners use
+        if 'r' in mode:
+            f = io.BytesIO(self.read(fname))
+        else:
+            f = Buffer(self, fname)
+        return f if 'b' in mode else io.TextIOWrapper(f, encoding = 'utf-8')
+
+    def remove(self, fname):
+        if not self.exists(fname):
+            return
+        with self.lock:
+            self.files[fname] = None
+            self.writes.pop(fname, None)
+            self.removes.append(fname)
+
+    def render(self, recipe, key, fnames):
+        # an image we would have rendered, key identifies its contents
+        with self.lock:
+            self.renders.append((recipe, key, fnames))
+
+    def report(self):
+        print()
+        for (fname, h) in sorted(self.writes.items()):
+            print(f'write   {h[:12]}  {fname}')
+        for fname in self.removes:
+            print(f'remove  {fname}')
+        for (recipe, key, fnames) in sorted(self.renders, key = lambda r: r[2][0]):
+            w, h = recipe.size
+            for fname in fnames:
+                print(f'render  {key[:12]}  {fname} ({w}x{h} {recipe.format})')
+        print(f'{len(self.writes)} writes, {len(self.removes)} removes, '
+              f'{sum(len(fnames) for (recipe, key, fnames) in self.renders)} images '
+              f'({len(self.renders)} renders)')
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump({
+                'writes': [{'fname': k, 'sha256': v, 'size': len(self.files[k])}
+                           for (k, v) in sorted(self.writes.items())],
+                'removes': self.removes,
+                'renders': [{'recipe': recipe._asdict(), 'key': key, 'fnames': fnames}
+                            for (recipe, key, fnames) in self.renders]
+            }, f, indent = 2)
+            f.write('\n')
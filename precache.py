@@ -0,0 +1,25 @@
+# -*- mode: python -*-
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    # only the .gz copies are written without it
+    brotli = None
+
+# a compressed copy is only kept when it is at most this much of the
+#  original, otherwise it isn't worth the CDN serving it
+RATIO = 0.9
+
+# the compressed copies, which are never compressed again or precached
+SIBLINGS = ('.gz', '.br')
+
+# the list of every file under public/ and its hash, for the service worker
+MANIFEST = 'precache-manifest.json'
+
+def compress(data):
+    # [(extension, compressed)] for each encoding, compressed is None when
+    #  it doesn't help (or isn't available), and any old copy should go
+    encoded = [('.gz', gzip.compress(data, 9, mtime = 0)),
+               ('.br', brotli.compress(data, quality = 11) if brotli else None)]
+    return [(ext, c if c is not None and len(c) <= len(data) * RATIO else None) for (ext, c) in encoded]
@@ -0,0 +1,214 @@
+# -*- mode: python -*-
+import io
+import hashlib
+import threading
+import subprocess
+import collections
+
+from PIL import Image, ImageChops, ImageDraw
+
+try:
+    # adds avif to an older Pillow
+    import pillow_avif
+except ImportError:
+    pass
+
+from transmogrifier.jobs import Jobs
+from transmogrifier.cache import Cache
+from transmogrifier.writer import Writer
+from transmogrifier import optimize, tracing, ico
+
+# rounded icons use a 50px corner on a 512x512 icon
+CORNER_RATIO = 50 / 512
+
+# bump this whenever the rendering changes, to invalidate cached images
+VERSION = 2
+
+# resolutions embedded in favicon.ico
+FAVICON_SIZES = (256, 192, 152, 144, 128, 96, 72, 64, 48, 32, 24, 16)
+
+# the other formats icons can be encoded in, and their Pillow options.
+#  Icons are flat colors and sharp edges, so a high quality is needed
+#  to avoid ringing, and it is still well under the size of a png.
+ENCODERS = {
+    'webp': {'quality': 90, 'method': 6},
+    'avif': {'quality': 80}
+}
+
+MIME_TYPES = {
+    'png': 'image/png',
+    'ico': 'image/x-icon',
+    'webp': 'image/webp',
+    'avif': 'image/avif'
+}
+
+def available(format):
+    # whether this Pillow can encode format, avif needs Pillow 11.2 or
+    #  the pillow-avif-plugin
+    Image.init()
+    return format.upper() in Image.SAVE
+
+class Recipe(collections.namedtuple('Recipe', ('size', 'corners', 'alpha', 'frame', 'format'))):
+    # Describes how an image is derived from the logo
+    #  size    - (width, height) of the output image
+    #  corners - radius of the rounded corner mask (0 for none)
+    #  alpha   - keep transparency, otherwise flatten onto white (-alpha off)
+    #  frame   - size of the logo centered in a white frame (splash screens)
+    #  format  - png, ico, or one of ENCODERS
+
+    @classmethod
+    def icon(cls, size, rounded = False, alpha = True):
+        corners = int(size * CORNER_RATIO) if rounded else 0
+        return cls((size, size), corners, alpha, None, 'png')
+
+    @classmethod
+    def favicon(cls):
+        return cls((256, 256), int(256 * CORNER_RATIO), True, None, 'ico')
+
+    @classmethod
+    def splash(cls, width, height):
+        # our logo is square, and takes up a quarter of the shortest side
+        return cls((width, height), 0, False, int(min(width, height) / 4), 'png')
+
+class Raster:
+    def __init__(self, config, resolution = 1024, cache = None, jobs = None, optimize = None, writer = None):
+        self.config = config
+        # largest resolution we need (the 1024x1024 iOS icon),
+        #  everything else, including the splash screens, is smaller
+        self.resolution = resolution
+        self.cache = cache
+        self.jobs = jobs or Jobs()
+        # recompress the pngs, one of optimize.MODES or None
+        self.optimize = optimize
+        # every file of the build is written through this, see Writer
+        self.writer = writer or Writer()
+        # (default, optimized) size of every png optimized by this build
+        self.sizes = {}
+        # encoded icons, up to the largest favicon layer, so favicon.ico
+        #  can reuse the icons of the same size
+        self.encoded = {}
+        self.lock = threading.Lock()
+        self.master = None
+        self.pyramid = {}
+        self.logo_hash = None
+
+    def reset(self):
+        # forget the decoded logo, after logo.svg changed
+        with self.lock:
+            self.master = None
+            self.pyramid = {}
+            self.logo_hash = None
+            self.encoded = {}
+
+    def digest(self):
+        # sha256 of the logo.svg, used to key the cache
+        if self.logo_hash is None:
+            with open(self.config.logo_svg, 'rb') as f:
+                self.logo_hash = hashlib.sha256(f.read()).hexdigest()
+        return self.logo_hash
+
+    def decode(self):
+        # rasterize the logo.svg a single time, every image is derived from this
+        with self.lock:
+            if self.master is None:
+                p = tracing.run(['convert',
+                                 self.config.logo_svg,
+                                 '-resize', f'{self.resolution}x{self.resolution}',
+                                 'png:-'],
+                                check = True, stdout = subprocess.PIPE)
+                self.master = Image.open(io.BytesIO(p.stdout)).convert('RGBA')
+            return self.master
+
+    def logo(self, size):
+        # the logo scaled to fit in a size x size box, cached per size
+        if size not in self.pyramid:
+            master = self.decode()
+            scale = size / max(master.size)
+            w = max(1, round(master.width * scale))
+            h = max(1, round(master.height * scale))
+            # another worker may have beaten us to it, keep the first one
+            self.pyramid.setdefault(size, master.resize((w, h), Image.LANCZOS))
+        return self.pyramid[size]
+
+    def image(self, recipe):
+        w, h = recipe.size
+        if recipe.frame:
+            # center the logo in a white frame
+            logo = self.flatten(self.logo(recipe.frame))
+            img = Image.new('RGB', recipe.size, 'white')
+            img.paste(logo, ((w - logo.width) // 2, (h - logo.height) // 2))
+            return img
+
+        img = self.logo(max(w, h))
+        if recipe.corners:
+            # draw a rounded rectangle and only keep the logo inside of it (SrcIn)
+            mask = Image.new('L', recipe.size, 0)
+            ImageDraw.Draw(mask).rounded_rectangle((0, 0, w - 1, h - 1), recipe.corners, fill = 255)
+            canvas = Image.new('RGBA', recipe.size, (0, 0, 0, 0))
+            canvas.paste(img, (0, 0))
+            canvas.putalpha(ImageChops.multiply(canvas.getchannel('A'), mask))
+            img = canvas
+
+        if not recipe.alpha:
+            img = self.flatten(img)
+        return img
+
+    def flatten(self, img):
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, (0, 0), img)
+        return background
+
+    def render(self, recipe):
+        if recipe.format == 'ico':
+            return self.favicon()
+        if recipe.format in ENCODERS:
+            b = io.BytesIO()
+            self.image(recipe).save(b, format = recipe.format.upper(), **ENCODERS[recipe.format])
+            return b.getvalue()
+        return self.png(recipe)
+
+    def png(self, recipe):
+        if recipe in self.encoded:
+            return self.encoded[recipe]
+
+        img = self.image(recipe)
+        if self.optimize:
+            default, data = optimize.png(img, self.optimize)
+            self.sizes[recipe] = (len(default), len(data))
+        else:
+            b = io.BytesIO()
+            img.save(b, format = 'PNG')
+            data = b.getvalue()
+
+        if max(recipe.size) <= max(FAVICON_SIZES):
+            self.encoded.setdefault(recipe, data)
+        return data
+
+    def favicon(self):
+        # every layer is the rounded icon of that size, the large ones are
+        #  the same pngs as the icons, the small ones are bitmaps
+        layers = []
+        for size in FAVICON_SIZES:
+            recipe = Recipe.icon(size, rounded = True)
+            layers.append((size, self.png(recipe) if size >= ico.PNG_SIZE else self.image(recipe)))
+        return ico.encode(layers)
+
+    def key(self, recipe):
+        # identifies the contents of an image, without rendering it
+        parts = [VERSION, self.digest(), self.resolution, tuple(recipe)]
+        if self.optimize:
+            parts.append(self.optimize)
+        return Cache.key(*parts)
+
+    def write(self, recipe, fname):
+        if self.cache is None:
+            self.writer.write(fname, self.render(recipe))
+            return
+
+        key = self.key(recipe)
+        if not self.cache.fetch(key, fname, self.writer.link):
+            self.cache.store(key, self.render(recipe), fname, self.writer.link)
+
+    def write_all(self, images):
+        # render a list of (recipe, fname) in parallel
+        self.jobs.run([(fname, self.write, (recipe, fname)) for (recipe, fname) in images])
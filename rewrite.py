@@ -0,0 +1,71 @@
+# -*- mode: python -*-
+import re
+import functools
+import collections
+
+# A single replacement, anchor is either a string or a compiled regex,
+#  and replacement is either a string or a function of the regex match.
+#  count is how many times the anchor must match (None for any number).
+Rule = collections.namedtuple('Rule', ('anchor', 'replacement', 'count'))
+
+# inline flags that can be scoped to a single alternative
+FLAGS = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x'))
+
+def pattern(anchor):
+    if isinstance(anchor, str):
+        return re.escape(anchor)
+    flags = ''.join(f for (flag, f) in FLAGS if anchor.flags & flag)
+    return f'(?{flags}:{anchor.pattern})' if flags else anchor.pattern
+
+@functools.lru_cache(maxsize = None)
+def combine(patterns):
+    # every anchor of a file in one regex, compiled once per process
+    return re.compile('|'.join(f'(?P<r{i}>{p})' for (i, p) in enumerate(patterns)))
+
+class Rewrite:
+    # Applies every rule for a file in a single pass over it, instead of a
+    #  pass per replacement. All of the files are rewritten in memory, and
+    #  nothing is written if any anchor didn't match as often as expected.
+    def __init__(self, name):
+        self.name = name
+        self.rules = {}
+
+    def rule(self, fname, anchor, replacement, count = None):
+        self.rules.setdefault(fname, []).append(Rule(anchor, replacement, count))
+        return self
+
+    def rewrite(self, text, rules):
+        regex = combine(tuple(pattern(r.anchor) for r in rules))
+        counts = [0] * len(rules)
+
+        def replace(m):
+            i = int(m.lastgroup[1:])
+            counts[i] += 1
+            rule = rules[i]
+            if callable(rule.replacement):
+                if isinstance(rule.anchor, str):
+                    return rule.replacement(m.group())
+                return rule.replacement(rule.anchor.fullmatch(m.group()))
+            return rule.replacement
+
+        return (regex.sub(replace, text), counts)
+
+    def apply(self, runner, moves = None):
+        # moves is {fname: dest}, for files whose rewrite is written
+        #  somewhere else
+        output = {}
+        errors = []
+        for (fname, rules) in self.rules.items():
+            text, counts = self.rewrite(runner.oread(fname), rules)
+            for (rule, count) in zip(rules, counts):
+                if rule.count is not None and rule.count != count:
+                    anchor = rule.anchor if isinstance(rule.anchor, str) else rule.anchor.pattern
+                    errors.append(f'{fname}: expected {rule.count} of {anchor!r}, found {count}')
+            output[fname] = text
+
+        if errors:
+            raise Exception(f'{self.name}: Unable to match\n  ' + '\n  '.join(errors))
+
+        for (fname, text) in output.items():
+            with runner.o((moves or {}).get(fname, fname), 'w') as f:
+                f.write(text)
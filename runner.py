@@ -1,34 +1,327 @@
+import os
 import sys
+import time
 import argparse
 
 from transmogrifier.runners.web import Web
 from transmogrifier.runners.ios import IOS
 from transmogrifier.runners.android import Android
+from transmogrifier.raster import Raster
+from transmogrifier.cache import Cache
+from transmogrifier.jobs import Jobs, Step
+from transmogrifier.templates import Templates
+from transmogrifier.ledger import Ledger
+from transmogrifier.store import TemplateStore
+from transmogrifier.assets import AssetPlan
+from transmogrifier import optimize
+from transmogrifier.tracing import Tracer
+from transmogrifier.plan import Plan
+from transmogrifier.config import load_config
+from transmogrifier.archive import Archive
+from transmogrifier.delta import Delta
+from transmogrifier.writer import Writer
+
+def add_build_arguments(parser):
+    # options shared by Runner and Batch
+    parser.add_argument('--cache-dir',
+                        help = 'Cache rendered icons and splash screens in this directory')
+    parser.add_argument('--cache-size', type = int, default = 512,
+                        help = 'Maximum size of the image cache in MB (default: 512)')
+    parser.add_argument('-j', '--jobs', type = int,
+                        help = 'Number of steps and images to run in parallel (default: number of cores)')
+    parser.add_argument('-f', '--force', action = 'store_true',
+                        help = 'Run every step, even if nothing it depends on has changed')
+    parser.add_argument('--template-store',
+                        help = 'Create the build trees from the versioned base projects in this directory')
+    parser.add_argument('--trace', metavar = 'FILE',
+                        help = 'Write a Chrome trace of every step to FILE, and print a summary')
+    parser.add_argument('--plan', nargs = '?', const = '-', metavar = 'FILE',
+                        help = 'Print every write, remove, and render without doing any of them, '
+                               'and save them as json to FILE')
+    parser.add_argument('--package', metavar = 'DIR',
+                        help = 'Write a deterministic zip of each build tree to DIR')
+    parser.add_argument('--delta', metavar = 'DIR',
+                        help = 'Write the files that changed since the last build, and the deleted files, to DIR')
+    parser.add_argument('--delta-base', metavar = 'DIR',
+                        help = 'Compare against the manifests of the build in DIR (default: the --delta DIR)')
+    parser.add_argument('--precompress', action = 'store_true',
+                        help = 'Write .gz and .br copies of the web build\'s public files, '
+                               'and a precache manifest of their hashes')
+    parser.add_argument('--modern-icons', action = 'store_true',
+                        help = 'Also write webp (and avif, when Pillow supports it) copies of the web icons, '
+                               'and list them in manifest.json')
+    parser.add_argument('--optimize-png', choices = optimize.MODES,
+                        help = 'Recompress the generated pngs, palette also quantizes them to 256 colors')
+
+def cache_from_args(args):
+    if args.cache_dir:
+        return Cache(args.cache_dir, args.cache_size * 1024 * 1024)
+    return None
 
 class Runner:
-    def __init__(self, config):
+    def __init__(self, config, jobs = None, cache = None, templates = None, force = False, store = None,
+                 optimize = None, tracer = None, plan = None, package = None,
+                 delta = None, precompress = False, modern_icons = False):
         self.config = config
-        self.web = Web(config)
-        self.ios = IOS(config)
-        self.android = Android(config)
+        self.store = store
+        # records how long every step takes, and what it does
+        self.tracer = tracer
+        # a dry run, where nothing is written
+        self.plan = plan
+        # where --plan saves the plan, - (or None) only reports it
+        self.plan_file = None
+        self.watching = False
+        # write a zip of each build tree to this directory
+        self.package = package
+        # write what changed since the previous build, see Delta
+        self.delta = delta
+        self.jobs = jobs or Jobs()
+        # only writes files whose contents changed
+        self.writer = Writer()
+        # skips steps that have nothing to do since the last build
+        self.ledger = Ledger(config, force, self.writer)
+        # templates can be shared between tenants
+        self.templates = templates or Templates()
+        # the logo is decoded once and shared by all the runners
+        self.raster = Raster(config, cache = cache, jobs = self.jobs, optimize = optimize, writer = self.writer)
+        self.web = Web(config, self.raster, self.templates)
+        self.web.precompress = precompress
+        self.web.modern_icons = modern_icons
+        self.ios = IOS(config, self.raster, self.templates)
+        self.android = Android(config, self.raster, self.templates)
 
     def go(self):
         self.parse_args()
-        
+        if self.watching:
+            try:
+                self.watch()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        try:
+            self.build()
+        finally:
+            # a trace of a failed build is still useful
+            if self.tracer:
+                self.tracer.save()
+                self.tracer.summary()
+
+        if self.raster.cache:
+            print(f'image cache: {self.raster.cache.hits} hits, {self.raster.cache.misses} misses')
+        if self.plan:
+            self.plan.report()
+            if self.plan_file not in (None, '-'):
+                self.plan.save(self.plan_file)
+
+    def build(self):
+        # the steps of all the runners are run together, independent steps
+        #  (including across platforms) run concurrently. The images of
+        #  all the runners are rendered by a single plan, so an image
+        #  shared by several platforms is only rendered once.
+        assets = AssetPlan(self.raster)
+        for runner in (self.web, self.ios, self.android):
+            assets.add(runner.images())
+        steps = self.web.steps(False) + self.ios.steps(False) + self.android.steps(False)
+        if self.plan:
+            return self.dry_run(self.plan, steps, assets)
+
+        self.preflight(steps, assets)
+        self.prepare()
+
         print('running')
-        self.web.go()
-        self.ios.go()
-        self.android.go()
-        
+        render = Step('Runner.render_images', assets.render, (os.path.abspath(self.config.logo_svg),), tuple(assets.fnames()),
+                      (('optimize', self.raster.optimize),))
+        steps = steps + [render]
+        # what ran, and was skipped, in this build (watch builds many times)
+        self.ledger.ran = []
+        self.ledger.skipped = []
+        self.writer.reset()
+        wrapped = [self.ledger.wrap(step) for step in steps]
+        if self.tracer:
+            wrapped = [self.tracer.wrap(step, self.config.repo) for step in wrapped]
+        try:
+            self.jobs.run_steps(wrapped)
+        finally:
+            self.ledger.save()
+        if self.web.precompress:
+            self.web.precache()
+
+        if render.name in self.ledger.ran:
+            if assets.deduplicated():
+                print(f'rendered {assets.renders()} images for {len(assets.fnames())} files ({assets.deduplicated()} deduplicated)')
+            if self.raster.optimize:
+                assets.report([('web', self.web.images()), ('ios', self.ios.images()), ('android', self.android.images())])
+        if self.ledger.skipped:
+            print(f'skipped {len(self.ledger.skipped)} of {len(steps)} unchanged steps')
+        if self.writer.skipped:
+            print(f'skipped {self.writer.skipped} of {self.writer.written + self.writer.skipped} unchanged writes')
+        if self.package:
+            self.package_trees()
+        if self.delta:
+            for (kind, c, runner) in self.trees():
+                changed, deleted = self.delta.write(runner.base_path(''))
+                print(f'{os.path.basename(os.path.normpath(runner.base_path("")))}: '
+                      f'{len(changed)} changed, {len(deleted)} deleted')
+
+    def package_trees(self):
+        os.makedirs(self.package, exist_ok = True)
+        for (kind, c, runner) in self.trees():
+            path = os.path.normpath(runner.base_path(''))
+            fname = Archive(os.path.join(self.package, os.path.basename(path) + '.zip'), self.jobs.workers).write(path)
+            print(f'packaged {fname}')
+
+    def preflight(self, steps, assets):
+        # Check that everything the build needs is there (files, anchors,
+        #  xml nodes) before anything is changed, by doing a dry run
+        errors = []
+        for (field, fname) in (('logo_svg', self.config.logo_svg),
+                               ('montclair_config.configuration_js_file', self.config.montclair_config.configuration_js_file)):
+            if not os.path.isfile(fname):
+                errors.append(f'{field}: {fname} does not exist')
+
+        if not errors:
+            try:
+                self.dry_run(Plan(), steps, assets, keep_going = True)
+            except Exception as e:
+                errors.append(str(e))
+
+        if errors:
+            raise Exception(f'Runner: Preflight failed for {self.config.repo}\n  ' + '\n  '.join(errors))
+
+    def dry_run(self, plan, steps, assets, keep_going = False):
+        # run every step against the plan, which reads the pristine
+        #  templates, and keeps what would be written in memory. The images
+        #  are only recorded, not rendered.
+        if self.store:
+            plan.sources.append(self.template)
+        plan.sources.append(self.ledger.pristine)
+        for runner in (self.web, self.ios, self.android):
+            runner.plan = plan
+        try:
+            self.jobs.run_steps(steps, keep_going)
+        finally:
+            for runner in (self.web, self.ios, self.android):
+                runner.plan = None
+
+        for (recipe, fnames) in assets.groups.items():
+            plan.render(recipe, self.raster.key(recipe), fnames)
+
+    def watch(self, interval = 0.5):
+        # Build, and then build again whenever the logo, Configuration.js,
+        #  or the tenant's json file changes. Everything stays in memory
+        #  between builds, and the ledger only reruns the steps that depend
+        #  on what changed.
+        stamps = self.stamps()
+        while True:
+            try:
+                self.build()
+            except Exception as e:
+                print(e, file = sys.stderr)
+            print('watching for changes...')
+
+            while True:
+                time.sleep(interval)
+                current = self.stamps()
+                if current != stamps:
+                    break
+            changed = [fname for fname in current if current[fname] != stamps.get(fname)]
+            stamps = current
+            print(f'changed: {", ".join(changed)}')
+
+            if self.config.fname in changed:
+                try:
+                    self.reload(load_config(self.config.fname))
+                except Exception as e:
+                    print(e, file = sys.stderr)
+                    continue
+            if self.config.logo_svg in changed:
+                self.raster.reset()
+
+    def stamps(self):
+        # (mtime, size) of every file we watch, None if it doesn't exist
+        stamps = {}
+        for fname in (self.config.logo_svg, self.config.montclair_config.configuration_js_file, self.config.fname):
+            if fname:
+                try:
+                    st = os.stat(fname)
+                    stamps[fname] = (st.st_mtime_ns, st.st_size)
+                except FileNotFoundError:
+                    stamps[fname] = None
+        return stamps
+
+    def reload(self, config):
+        # switch to a changed config, keeping the templates and the logo
+        self.config = config
+        self.ledger = Ledger(config, self.ledger.force, self.writer)
+        if config.logo_svg != self.raster.config.logo_svg:
+            self.raster.reset()
+        self.raster.config = config
+        for runner in (self.web, self.ios, self.android):
+            runner.config = config
+
+    def trees(self):
+        # (kind, config, runner) of each build tree
+        trees = [('montclair', self.config.montclair_config, self.web)]
+        if self.config.ios_config:
+            trees.append(('montclair-pwa-ios', self.config.ios_config, self.ios))
+        if self.config.android_config:
+            trees.append(('montclair-pwa-android', self.config.android_config, self.android))
+        return trees
+
+    def template(self, fname):
+        # where fname is in the template store
+        for (kind, c, runner) in self.trees():
+            base = os.path.normpath(runner.base_path(''))
+            if fname.startswith(base + os.sep):
+                return os.path.join(self.store.template(kind, c.version), os.path.relpath(fname, base))
+        return None
+
+    def prepare(self):
+        # create the build trees from the template store
+        if self.store is None:
+            return
+
+        for (kind, c, runner) in self.trees():
+            self.store.materialize(kind, c.version, os.path.normpath(runner.base_path('')))
+
     def parse_args(self):
         parser = argparse.ArgumentParser()
         parser.add_argument('-e', '--env', action = 'store_true',
                             help = 'Write out an ENV file')
+        parser.add_argument('-w', '--watch', action = 'store_true',
+                            help = 'Keep running, and rebuild whatever depends on the logo, '
+                                   'Configuration.js, or the tenant config when they change')
+        add_build_arguments(parser)
 
         args = parser.parse_args()
         if args.env:
             self.write_env()
             sys.exit(0)
+
+        if args.jobs:
+            self.jobs.workers = args.jobs
+        self.ledger.force = args.force
+        if args.template_store:
+            self.store = TemplateStore(args.template_store)
+        if args.cache_dir:
+            self.raster.cache = cache_from_args(args)
+        if args.optimize_png:
+            self.raster.optimize = args.optimize_png
+        if args.trace:
+            self.tracer = Tracer(args.trace)
+        if args.plan:
+            self.plan = Plan()
+            self.plan_file = args.plan
+        self.watching = args.watch
+        if args.package:
+            self.package = args.package
+        if args.delta:
+            self.delta = Delta(args.delta, args.delta_base, self.jobs.workers)
+        if args.precompress:
+            self.web.precompress = True
+        if args.modern_icons:
+            self.web.modern_icons = True
         
     def write_env(self):
         with open('ENV', 'w') as f:
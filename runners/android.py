@@ -2,222 +2,252 @@
 
 import sys
 import os
-import subprocess
-import xml.etree.ElementTree as ET
-import urllib.parse
-import json
+
+from transmogrifier.raster import Raster, Recipe, CORNER_RATIO
+from transmogrifier.jobs import Step
+from transmogrifier.templates import Templates
+from transmogrifier.rewrite import Rewrite
+from transmogrifier.xmlpatch import XMLPatch, WIDGETS, ANDROID
+from transmogrifier.manifest import write_manifests, pwa_manifest
+from transmogrifier.vector import vector_drawable
+
+RES = 'platforms/android/app/src/main/res'
+
+# the launcher icons, as (path under res, size). The -v26 ones are the
+#  layers of the adaptive icon, the others are for older launchers
+LAUNCHER_ICONS = (
+    ('mipmap-xxxhdpi/ic_launcher.png', 192),
+    ('mipmap-xxxhdpi-v26/ic_launcher_monochrome.png', 432),
+    ('mipmap-xxxhdpi-v26/ic_launcher_foreground.png', 432),
+    ('mipmap-xxhdpi/ic_launcher.png', 144),
+    ('mipmap-xxhdpi-v26/ic_launcher_monochrome.png', 324),
+    ('mipmap-xxhdpi-v26/ic_launcher_foreground.png', 324),
+    ('mipmap-xhdpi/ic_launcher.png', 96),
+    ('mipmap-xhdpi-v26/ic_launcher_monochrome.png', 216),
+    ('mipmap-xhdpi-v26/ic_launcher_foreground.png', 216),
+    ('mipmap-hdpi/ic_launcher.png', 72),
+    ('mipmap-hdpi-v26/ic_launcher_monochrome.png', 163),
+    ('mipmap-hdpi-v26/ic_launcher_foreground.png', 163),
+    ('mipmap-mdpi/ic_launcher.png', 48),
+    ('mipmap-mdpi-v26/ic_launcher_monochrome.png', 108),
+    ('mipmap-mdpi-v26/ic_launcher_foreground.png', 108),
+    ('mipmap-ldpi/ic_launcher.png', 36),
+    ('mipmap-ldpi-v26/ic_launcher_monochrome.png', 36),
+    ('mipmap-ldpi-v26/ic_launcher_foreground.png', 36)
+)
+
+# the adaptive icon layers as vector drawables, anydpi takes precedence
+#  over the pngs of every density
+VECTOR_ICONS = (
+    ('mipmap-anydpi-v26/ic_launcher_foreground.xml', False),
+    ('mipmap-anydpi-v26/ic_launcher_monochrome.xml', True)
+)
 
 class Android:
-    def __init__(self, config):
+    def __init__(self, config, raster = None, templates = None):
         self.config = config
+        self.raster = raster or Raster(config)
+        self.templates = templates or Templates()
+        # when set, files are read from and written to the plan instead
+        self.plan = None
 
     def go(self):
+        for step in self.steps():
+            step.fn()
+
+    def steps(self, images = True):
+        # every step, in order, along with the files it reads and writes,
+        #  and the config fields it uses. Without images, the icons are
+        #  left to the caller, see images()
         if self.config.android_config is None:
             print('Skipping Android PWA creation...', file = sys.stderr)
-            return
+            return []
 
-        self.update_android_json()
-        self.update_config_xml()
-        self.update_strings_xml()
-        self.update_manifest_json()
-        self.update_android_manifest()
-        self.update_package_name()
-        self.update_generation_info()
-        self.create_icons()
+        android_json = ('platforms/android/android.json', 'plugins/android.json')
+        config_xml = ('config.xml', 'platforms/android/app/src/main/res/xml/config.xml')
+        strings_xml = ('platforms/android/app/src/main/res/values/strings.xml',)
+        manifest_json = ('manifest.json', 'www/manifest.json', 'platforms/android/app/src/main/assets/www/manifest.json')
+        android_manifest = ('platforms/android/app/src/main/AndroidManifest.xml',)
+        src_dir = os.path.join('platforms', 'android', 'app', 'src', 'main', 'java')
+        main_activity = (os.path.join(src_dir, 'net', 'line72', 'montclair', 'MainActivity.java'),
+                         os.path.join(src_dir, *self.config.android_config.app_id.split('.'), 'MainActivity.java'))
+        icons = [fname for (recipe, fname) in self.icons()]
+        steps = [
+            self.step(self.update_android_json, android_json, android_json,
+                      ('android_config.app_id',)),
+            self.step(self.update_config_xml, config_xml, config_xml,
+                      ('android_config.app_id', 'android_config.version', 'name', 'description', 'url')),
+            self.step(self.update_strings_xml, strings_xml, strings_xml,
+                      ('name',)),
+            self.step(self.update_manifest_json, manifest_json, manifest_json,
+                      ('name', 'description', 'url')),
+            self.step(self.update_android_manifest, android_manifest, android_manifest,
+                      ('android_config.version', 'android_config.revision', 'android_config.app_id')),
+            self.step(self.update_package_name, main_activity[:1], main_activity,
+                      ('android_config.app_id',)),
+            self.step(self.update_generation_info, ('generationInfo.json',), ('generationInfo.json',),
+                      ('url',)),
+            self.step(self.update_vector_icons, self.vector_icons()[:len(VECTOR_ICONS)], self.vector_icons(),
+                      ('android_config.vector_icons',), inputs = (self.config.logo_svg,))
+        ]
+        if images:
+            steps += [
+                self.step(self.create_icons, (), icons, inputs = (self.config.logo_svg,))
+            ]
+        return steps
 
     def update_android_json(self):
         # Update platforms/android/android.json and plugins/android.json
+        rewrite = Rewrite('Runner.Android')
         for i in ('platforms/android/android.json', 'plugins/android.json'):
-            m = self.oread(i)
-            m = m.replace('net.line72.montclair', self.config.android_config.app_id)
-
-            with self.o(i, 'w') as f:
-                f.write(m)
+            rewrite.rule(i, 'net.line72.montclair', self.config.android_config.app_id)
+        rewrite.apply(self)
 
     def update_config_xml(self):
         # Updates platforms/android/res/xml/config.xml and config.xml
-        for i in ('config.xml', 'platforms/android/app/src/main/res/xml/config.xml'):
-            tree = ET.parse(self.base_path(i))
-            root = tree.getroot()
-        
-            # register the namespace
-            # See: https://stackoverflow.com/questions/3895951/create-svg-xml-document-without-ns0-namespace-using-python-elementtree
-            ns = 'http://www.w3.org/ns/widgets'
-            ET.register_namespace('', ns)
-            ET.register_namespace('cdv', 'http://cordova.apache.org/ns/1.0')
-            
-            # update the root id and version
-            root.set('id', self.config.android_config.app_id)
-            root.set('version', self.config.android_config.version)
-            # find the name, description, and content nodes, allow-navigation and update them
-            name = root.find(f'.//{{{ns}}}name')
-            name.text = self.config.name
-            
-            description = root.find(f'.//{{{ns}}}description')
-            description.text = self.config.description
-            
-            content = root.find(f'.//{{{ns}}}content')
-            content.set('src', f'{self.config.url}/index.html')
-            
-            nav = root.find(f'.//{{{ns}}}allow-navigation')
-            nav.set('href', f'{self.config.url}/*')
-            
-            # write back out
-            tree.write(self.base_path(i),
-                       encoding='utf-8', xml_declaration = True,
-                       default_namespace = '')
+        #  find the name, description, and content nodes, allow-navigation and update them
+        XMLPatch('Runner.Android').attr(
+            '.', 'id', self.config.android_config.app_id
+        ).attr(
+            '.', 'version', self.config.android_config.version
+        ).text(
+            f'.//{{{WIDGETS}}}name', self.config.name
+        ).text(
+            f'.//{{{WIDGETS}}}description', self.config.description
+        ).attr(
+            f'.//{{{WIDGETS}}}content', 'src', f'{self.config.url}/index.html'
+        ).attr(
+            f'.//{{{WIDGETS}}}allow-navigation', 'href', f'{self.config.url}/*'
+        ).apply(self, ('config.xml', 'platforms/android/app/src/main/res/xml/config.xml'))
 
     def update_strings_xml(self):
         # Update platforms/android/res/values/strings.xml
-        p = 'platforms/android/app/src/main/res/values/strings.xml'
-        
-        tree = ET.parse(self.base_path(p))
-        root = tree.getroot()
-
-        name = root.find(f".//string[@name='app_name']")
-        name.text = self.config.name
-        
-        # write back out
-        tree.write(self.base_path(p),
-                   encoding='utf-8', xml_declaration = True,
-                   default_namespace = '')
+        XMLPatch('Runner.Android').text(
+            ".//string[@name='app_name']", self.config.name
+        ).apply(self, ('platforms/android/app/src/main/res/values/strings.xml',))
 
     def update_manifest_json(self):
         # Update ./platforms/android/assets/www/manifest.json, www/manifest.json, and manifest.json
-        for i in ('manifest.json', 'www/manifest.json', 'platforms/android/app/src/main/assets/www/manifest.json'):
-            m = json.loads(self.oread(i))
-            m['short_name'] = self.config.name
-            m['name'] = self.config.name
-            m['description'] = self.config.description
-            m['start_url'] = self.config.url + '/index.html'
-
-            # fix all the icons
-            for icon in m['icons']:
-                url = urllib.parse.urlparse(icon['src'])
-                icon['src'] = f'{self.config.url}{url.path}'
-            
-            with self.o(i, 'w') as f:
-                f.write(json.dumps(m, indent = 4))
-                f.write('\n')
+        manifests = ('manifest.json', 'www/manifest.json', 'platforms/android/app/src/main/assets/www/manifest.json')
+        write_manifests(self, manifests, pwa_manifest, {
+            'name': self.config.name,
+            'description': self.config.description,
+            'url': self.config.url
+        })
 
     def update_android_manifest(self):
         # Update ./platforms/android/AndroidManifest.xml
-        p = 'platforms/android/app/src/main/AndroidManifest.xml'
-
-        tree = ET.parse(self.base_path(p))
-        root = tree.getroot()
-
-        ns = 'http://schemas.android.com/apk/res/android'
-        ET.register_namespace('android', ns)
-
-        root.set(f'{{{ns}}}versionName', f'{self.config.android_config.version}-{self.config.android_config.revision}')
-        root.set('package', self.config.android_config.app_id)
-
-        # write back out
-        tree.write(self.base_path(p),
-                   encoding='utf-8', xml_declaration = True,
-                   default_namespace = '')
+        XMLPatch('Runner.Android').attr(
+            '.', f'{{{ANDROID}}}versionName', f'{self.config.android_config.version}-{self.config.android_config.revision}'
+        ).attr(
+            '.', 'package', self.config.android_config.app_id
+        ).apply(self, ('platforms/android/app/src/main/AndroidManifest.xml',))
 
     def update_package_name(self):
         # Update the package net.line72.net.montclair in all the java files
         src_dir = os.path.join('platforms', 'android', 'app', 'src', 'main', 'java')
 
-        # First make the new directory based on the package name
         package_path = os.path.join(*self.config.android_config.app_id.split('.'))
-        full_path = self.base_path(os.path.join(src_dir, package_path))
-        os.makedirs(full_path)
-        # Next move move the net/line72/montclair/MainActivity.java to our new package name directory.
-        old_path = self.base_path(os.path.join(src_dir, 'net', 'line72', 'montclair'))
-        os.rename(os.path.join(old_path, 'MainActivity.java'), os.path.join(full_path, 'MainActivity.java'))
-    
-        # Then update the package name in:
-        # ./platforms/android/src/main/java/net/line72/NEW_PACKAGE_NAME/MainActivity.java
-        fname = os.path.join(src_dir, package_path, 'MainActivity.java')
-        j = self.oread(fname)
+        src = os.path.join(src_dir, 'net', 'line72', 'montclair', 'MainActivity.java')
+        dest = os.path.join(src_dir, package_path, 'MainActivity.java')
 
-        j = j.replace('net.line72.montclair', self.config.android_config.app_id)
-        with self.o(fname, 'w') as f:
-            f.write(j)
+        # Move the net/line72/montclair/MainActivity.java to our new package
+        #  name directory, and update the package name in it. It is written
+        #  once, so if it comes out the same as the one already there, it
+        #  keeps its mtime. If we've already been run, it has already been moved.
+        fname = src if src != dest and self.exists(src) else dest
+        Rewrite('Runner.Android').rule(fname, 'net.line72.montclair', self.config.android_config.app_id).apply(self, {src: dest})
+        if fname != dest:
+            self.remove(src)
 
     def update_generation_info(self):
         # update ./generationInfo.json
-        g = json.loads(self.oread('generationInfo.json'))
-        g['generatedURL'] = f'{self.config.url}/manifest.json'
+        def generation_info(g, v):
+            g['generatedURL'] = f"{v['url']}/manifest.json"
+
+        g = self.templates.json(self.oread('generationInfo.json'), generation_info, {'url': self.config.url})
         with self.o('generationInfo.json', 'w') as f:
-            f.write(json.dumps(g, indent = 4))
-            f.write('\n')
+            f.write(g)
+
+    def update_vector_icons(self):
+        # Write the adaptive icon foreground and monochrome layers as vector
+        #  drawables, and remove their pngs. Only the legacy ic_launcher.png
+        #  are still rendered, for launchers older than Android 8.
+        if not self.config.android_config.vector_icons:
+            # the ledger removes the vectors we wrote before (they would
+            #  hide the pngs), and puts back the template's own
+            return
+
+        with open(self.config.logo_svg, 'rb') as f:
+            logo = f.read()
+        for (i, monochrome) in VECTOR_ICONS:
+            try:
+                xml = vector_drawable(logo, CORNER_RATIO, monochrome = monochrome)
+            except Exception as e:
+                raise Exception(f'Runner.Android: Unable to convert {self.config.logo_svg}: {e}')
+            with self.o(f'{RES}/{i}', 'w') as f:
+                f.write(xml)
+        for (i, size) in LAUNCHER_ICONS:
+            if '-v26/' in i:
+                self.remove(f'{RES}/{i}')
+
+    def vector_icons(self):
+        # the files update_vector_icons writes, then the ones it removes.
+        #  It reads the ones it writes too, so the template's own are kept.
+        if not self.config.android_config.vector_icons:
+            return []
+        return ([f'{RES}/{i}' for (i, monochrome) in VECTOR_ICONS] +
+                [f'{RES}/{i}' for (i, size) in LAUNCHER_ICONS if '-v26/' in i])
+
+    def images(self):
+        # every image as (recipe, full path)
+        if self.config.android_config is None:
+            return []
+        return [(recipe, self.base_path(fname)) for (recipe, fname) in self.icons()]
 
     def create_icons(self):
-        # app-icon.png 512x512
-        subprocess.run(['convert',
-                        '-size', '512x512',
-                        'xc:none',
-                        '-fill', 'white',
-                        '-draw', 'roundRectangle 0,0 512,512 50,50',
-                        self.config.logo_svg,
-                        '-resize', '512x512',
-                        '-compose', 'SrcIn',
-                        '-composite',
-                        self.base_path('app-icon.png')],
-                       check = True)
-
-        # favicon.ico with multiple resolutions
-        subprocess.run(['convert',
-                        '-size', '256x256',
-                        'xc:none',
-                        '-fill', 'white',
-                        '-draw', 'roundRectangle 0,0 256,256 25,25',
-                        self.config.logo_svg,
-                        '-resize', '256x256',
-                        '-compose', 'SrcIn',
-                        '-composite',
-                        '-define', 'icon:auto-resize=256,192,152,144,128,96,72,64,48,32,24,16',
-                        self.base_path('favicon.ico')],
-                       check = True)
-
-        
-        icons = [
-            ('mipmap-xxxhdpi/ic_launcher.png', '192x192'),
-            ('mipmap-xxxhdpi-v26/ic_launcher_monochrome.png', '432x432'),
-            ('mipmap-xxxhdpi-v26/ic_launcher_foreground.png', '432x432'),
-            ('mipmap-xxhdpi/ic_launcher.png', '144x144'),
-            ('mipmap-xxhdpi-v26/ic_launcher_monochrome.png', '324x324'),
-            ('mipmap-xxhdpi-v26/ic_launcher_foreground.png', '324x324'),
-            ('mipmap-xhdpi/ic_launcher.png', '96x96'),
-            ('mipmap-xhdpi-v26/ic_launcher_monochrome.png', '216x216'),
-            ('mipmap-xhdpi-v26/ic_launcher_foreground.png', '216x216'),
-            ('mipmap-hdpi/ic_launcher.png', '72x72'),
-            ('mipmap-hdpi-v26/ic_launcher_monochrome.png', '163x163'),
-            ('mipmap-hdpi-v26/ic_launcher_foreground.png', '163x163'),
-            ('mipmap-mdpi/ic_launcher.png', '48x48'),
-            ('mipmap-mdpi-v26/ic_launcher_monochrome.png', '108x108'),
-            ('mipmap-mdpi-v26/ic_launcher_foreground.png', '108x108'),
-            ('mipmap-ldpi/ic_launcher.png', '36x36'),
-            ('mipmap-ldpi-v26/ic_launcher_monochrome.png', '36x36'),
-            ('mipmap-ldpi-v26/ic_launcher_foreground.png', '36x36')
+        self.raster.write_all([(recipe, self.base_path(fname)) for (recipe, fname) in self.icons()])
+
+    def icons(self):
+        # app-icon.png 512x512 and favicon.ico with multiple resolutions
+        images = [
+            (Recipe.icon(512, rounded = True), 'app-icon.png'),
+            (Recipe.favicon(), 'favicon.ico')
         ]
-        for i in icons:
-            c = i[1].split('x')
-            corners = ','.join(c)
-            corner_ratio = 50 / 512
-            corner_size = int(int(c[0]) * corner_ratio)
-            subprocess.run(['convert',
-                            '-size', i[1],
-                            'xc:none',
-                            '-fill', 'white',
-                            '-draw', f'roundRectangle 0,0 {corners} {corner_size},{corner_size}',
-                            self.config.logo_svg,
-                            '-resize', i[1],
-                            '-compose', 'SrcIn',
-                            '-composite',
-                            self.base_path(f'platforms/android/app/src/main/res/{i[0]}')],
-                           check = True)
+
+        for (i, size) in LAUNCHER_ICONS:
+            if '-v26/' in i and self.config.android_config.vector_icons:
+                # see update_vector_icons
+                continue
+            images.append((Recipe.icon(size, rounded = True), f'{RES}/{i}'))
+
+        return images
+
+    def step(self, fn, reads, writes, fields = (), inputs = ()):
+        # reads and writes are in our tree, inputs are files from outside
+        #  of it, like the logo, relative to the current directory
+        return Step(f'Android.{fn.__name__}', fn,
+                    tuple(self.base_path(f) for f in reads) + tuple(os.path.abspath(f) for f in inputs),
+                    tuple(self.base_path(f) for f in writes),
+                    fields)
     
     def base_path(self, fname):
         return os.path.join(self.config.build_dir, f'montclair-{self.config.repo}-pwa-android', fname)
 
     def o(self, fname, mode = 'r'):
-        return open(self.base_path(fname), mode)
+        if self.plan:
+            return self.plan.open(self.base_path(fname), mode)
+        return self.raster.writer.open(self.base_path(fname), mode)
+
+    def exists(self, fname):
+        if self.plan:
+            return self.plan.exists(self.base_path(fname))
+        return os.path.exists(self.base_path(fname))
+
+    def remove(self, fname):
+        if self.plan:
+            return self.plan.remove(self.base_path(fname))
+        self.raster.writer.remove(self.base_path(fname))
 
     def oread(self, fname):
         with self.o(fname) as f:
@@ -1,31 +1,67 @@
 # -*- mode: python -*-
 import sys
 import os
-import subprocess
-import xml.etree.ElementTree as ET
 import urllib.parse
-import json
+
+from transmogrifier.raster import Raster, Recipe
+from transmogrifier.jobs import Step
+from transmogrifier.templates import Templates
+from transmogrifier.rewrite import Rewrite
+from transmogrifier.xmlpatch import XMLPatch, WIDGETS
+from transmogrifier.manifest import write_manifests, pwa_manifest
 
 class IOS:
-    def __init__(self, config):
+    def __init__(self, config, raster = None, templates = None):
         self.config = config
+        self.raster = raster or Raster(config)
+        self.templates = templates or Templates()
+        # when set, files are read from and written to the plan instead
+        self.plan = None
 
     def go(self):
+        for step in self.steps():
+            step.fn()
+
+    def steps(self, images = True):
+        # every step, in order, along with the files it reads and writes,
+        #  and the config fields it uses. Without images, the icons and
+        #  splash screens are left to the caller, see images()
         if self.config.ios_config is None:
             print('Skipping iOS PWA creation...', file = sys.stderr)
-            return
-
-        self.update_project_pbx()
-        self.update_xcscheme()
-        self.update_package_json()
-        self.update_config_xml()
-        self.update_plist()
-        self.update_manifest()
-        self.update_ios_json()
-        self.update_index()
-        self.update_generation_info()
-        self.create_icons()
-        self.create_splash_screen()
+            return []
+
+        package_json = ('package.json', 'package-lock.json')
+        config_xml = ('config.xml', 'platforms/ios/Montclair/config.xml')
+        plist = ('platforms/ios/Montclair/Montclair-Info.plist',)
+        manifest = ('manifest.json', 'www/manifest.json', 'platforms/ios/www/manifest.json')
+        ios_json = ('platforms/ios/ios.json', 'plugins/ios.json')
+        generation_info = ('generationInfo.json', 'platforms/ios/generationInfo.json')
+        icons = [fname for (recipe, fname) in self.icons()]
+        splash_screens = [fname for (recipe, fname) in self.splash_screens()]
+        steps = [
+            self.step(self.update_project_pbx, (), ()),
+            self.step(self.update_xcscheme, (), ()),
+            self.step(self.update_package_json, package_json, package_json,
+                      ('package_name', 'name')),
+            self.step(self.update_config_xml, config_xml, config_xml,
+                      ('ios_config.app_id', 'montclair_config.version', 'name', 'description', 'url')),
+            self.step(self.update_plist, plist, plist,
+                      ('ios_config.app_id', 'url', 'name')),
+            self.step(self.update_manifest, manifest, manifest,
+                      ('name', 'description', 'url')),
+            self.step(self.update_ios_json, ios_json, ios_json,
+                      ('ios_config.app_id',)),
+            self.step(self.update_index, ('www/index.html',), ('www/index.html',),
+                      ('name',)),
+            self.step(self.update_generation_info, generation_info, generation_info,
+                      ('url',))
+        ]
+        if images:
+            steps += [
+                self.step(self.create_icons, (), icons, inputs = (self.config.logo_svg,)),
+                self.step(self.create_splash_screen, (), splash_screens, inputs = (self.config.logo_svg,))
+            ]
+        return steps
 
     def update_project_pbx(self):
         # update platforms/ios/Montclair.xcodeproj/project.pbxproj
@@ -37,91 +73,60 @@ class IOS:
     
     def update_package_json(self):
         # update the package.json and the package-lock.json
-        package = json.loads(self.oread('package.json'))
-        # replace the name
-        package['name'] = self.config.package_name
-        package['displayName'] = self.config.name
-        
-        with self.o('package.json', 'w') as f:
-            f.write(json.dumps(package, indent = 2))
-            f.write('\n')
+        def package(p, v):
+            # replace the name
+            p['name'] = v['package_name']
+            p['displayName'] = v['name']
 
-        package_lock = json.loads(self.oread('package-lock.json'))
-        # replace the name
-        package_lock['name'] = self.config.package_name
-        
-        with self.o('package-lock.json', 'w') as f:
-            f.write(json.dumps(package_lock, indent = 2))
-            f.write('\n')
+        def package_lock(p, v):
+            # replace the name
+            p['name'] = v['package_name']
+
+        values = {'package_name': self.config.package_name, 'name': self.config.name}
+        for (i, edit) in (('package.json', package), ('package-lock.json', package_lock)):
+            package_json = self.templates.json(self.oread(i), edit, values, indent = 2)
+            with self.o(i, 'w') as f:
+                f.write(package_json)
 
     def update_config_xml(self):
         # update config.xml and platforms/ios/Montclair/config.xml
-        for i in ('config.xml', 'platforms/ios/Montclair/config.xml'):
-            tree = ET.parse(self.base_path(i))
-            root = tree.getroot()
-        
-            # register the namespace
-            # See: https://stackoverflow.com/questions/3895951/create-svg-xml-document-without-ns0-namespace-using-python-elementtree
-            ns = 'http://www.w3.org/ns/widgets'
-            ET.register_namespace('', ns)
-            ET.register_namespace('cdv', 'http://cordova.apache.org/ns/1.0')
-            
-            # update the root id and version
-            root.set('id', self.config.ios_config.app_id)
-            root.set('version', self.config.montclair_config.version)
-            # find the name, description, and content nodes, allow-navigation and update them
-            name = root.find(f'.//{{{ns}}}name')
-            name.text = self.config.name
-            
-            description = root.find(f'.//{{{ns}}}description')
-            description.text = self.config.description
-            
-            content = root.find(f'.//{{{ns}}}content')
-            content.set('src', f'{self.config.url}/index.html')
-            
-            nav = root.find(f'.//{{{ns}}}allow-navigation')
-            if nav != None:
-                nav.set('href', f'{self.config.url}/*')
-            
-            # write back out
-            tree.write(self.base_path(i),
-                       encoding='utf-8', xml_declaration = True,
-                       default_namespace = '')
-            
+        #  find the name, description, and content nodes, allow-navigation and update them
+        XMLPatch('Runner.IOS').attr(
+            '.', 'id', self.config.ios_config.app_id
+        ).attr(
+            '.', 'version', self.config.montclair_config.version
+        ).text(
+            f'.//{{{WIDGETS}}}name', self.config.name
+        ).text(
+            f'.//{{{WIDGETS}}}description', self.config.description
+        ).attr(
+            f'.//{{{WIDGETS}}}content', 'src', f'{self.config.url}/index.html'
+        ).attr(
+            f'.//{{{WIDGETS}}}allow-navigation', 'href', f'{self.config.url}/*', required = False
+        ).apply(self, ('config.xml', 'platforms/ios/Montclair/config.xml'))
+
     def update_plist(self):
         # Update platforms/ios/Montclair/Montclair-Info.plist
 
         url = urllib.parse.urlparse(self.config.url).netloc
         
-        plist = self.oread('platforms/ios/Montclair/Montclair-Info.plist')
-        plist = plist.replace(
-            'net.line72.montclair', self.config.ios_config.app_id
-        ).replace(
-            'montclair.line72.net', url
-        ).replace(
-            '<string>Montclair</string>', f'<string>{self.config.name}</string>'
-        )
-
-        with self.o('platforms/ios/Montclair/Montclair-Info.plist', 'w') as f:
-            f.write(plist)
+        p = 'platforms/ios/Montclair/Montclair-Info.plist'
+        Rewrite('Runner.IOS').rule(
+            p, 'net.line72.montclair', self.config.ios_config.app_id
+        ).rule(
+            p, 'montclair.line72.net', url
+        ).rule(
+            p, '<string>Montclair</string>', f'<string>{self.config.name}</string>'
+        ).apply(self)
 
     def update_manifest(self):
         # Update manifest.json AND www/manifest.json, platforms/ios/www/manifest.json
-        for i in ('manifest.json', 'www/manifest.json', 'platforms/ios/www/manifest.json'):
-            m = json.loads(self.oread(i))
-            m['short_name'] = self.config.name
-            m['name'] = self.config.name
-            m['description'] = self.config.description
-            m['start_url'] = self.config.url + '/index.html'
-
-            # fix all the icons
-            for icon in m['icons']:
-                url = urllib.parse.urlparse(icon['src'])
-                icon['src'] = f'{self.config.url}{url.path}'
-            
-            with self.o(i, 'w') as f:
-                f.write(json.dumps(m, indent = 4))
-                f.write('\n')
+        manifests = ('manifest.json', 'www/manifest.json', 'platforms/ios/www/manifest.json')
+        write_manifests(self, manifests, pwa_manifest, {
+            'name': self.config.name,
+            'description': self.config.description,
+            'url': self.config.url
+        })
 
     def update_ios_json(self):
         # update platforms/ios/ios.json and plugins/ios.json
@@ -134,107 +139,92 @@ class IOS:
 
     def update_index(self):
         # Update www/index.html
-        i = self.oread('www/index.html')
-        with self.o('www/index.html', 'w') as f:
-            f.write(i.replace('Montclair', self.config.name))
+        Rewrite('Runner.IOS').rule('www/index.html', 'Montclair', self.config.name).apply(self)
 
     def update_generation_info(self):
         # Update generationInfo.json
+        def generation_info(g, v):
+            g['generatedURL'] = f"{v['url']}/manifest.json"
+
         for i in ('generationInfo.json', 'platforms/ios/generationInfo.json'):
-            g = json.loads(self.oread(i))
-            g['generatedURL'] = f'{self.config.url}/manifest.json'
+            g = self.templates.json(self.oread(i), generation_info, {'url': self.config.url})
             with self.o(i, 'w') as f:
-                f.write(json.dumps(g, indent = 4))
-                f.write('\n')
+                f.write(g)
+
+    def images(self):
+        # every image as (recipe, full path)
+        if self.config.ios_config is None:
+            return []
+        return [(recipe, self.base_path(fname)) for (recipe, fname) in self.icons() + self.splash_screens()]
 
     def create_icons(self):
-        # app-icon.png 512x512
-        subprocess.run(['convert',
-                        '-size', '512x512',
-                        'xc:none',
-                        '-fill', 'white',
-                        '-draw', 'roundRectangle 0,0 512,512 50,50',
-                        self.config.logo_svg,
-                        '-resize', '512x512',
-                        '-compose', 'SrcIn',
-                        '-composite',
-                        self.base_path('app-icon.png')],
-                       check = True)
-
-        # favicon.ico with multiple resolutions
-        subprocess.run(['convert',
-                        '-size', '256x256',
-                        'xc:none',
-                        '-fill', 'white',
-                        '-draw', 'roundRectangle 0,0 256,256 25,25',
-                        self.config.logo_svg,
-                        '-resize', '256x256',
-                        '-compose', 'SrcIn',
-                        '-composite',
-                        '-define', 'icon:auto-resize=256,192,152,144,128,96,72,64,48,32,24,16',
-                        self.base_path('favicon.ico')],
-                       check = True)
+        self.raster.write_all([(recipe, self.base_path(fname)) for (recipe, fname) in self.icons()])
+
+    def icons(self):
+        # app-icon.png 512x512 and favicon.ico with multiple resolutions
+        images = [
+            (Recipe.icon(512, rounded = True), 'app-icon.png'),
+            (Recipe.favicon(), 'favicon.ico')
+        ]
 
         # create a bunch of icons with transparency
         icons = [
-            ('AppIcon29x29@2x.png', '58x58'),
-            ('AppIcon40x40@2x.png', '80x80'),
-            ('icon.png', '57x57'),
-            ('icon120-1.png', '120x120'),
-            ('icon120.png', '120x120'),
-            ('icon152.png', '152x152'),
-            ('icon167.png', '167x167'),
-            ('icon180.png', '180x180'),
-            ('icon20.png', '20x20'),
-            ('icon29-1.png', '29x29'),
-            ('icon29.png', '29x29'),
-            ('icon40-1.png', '40x40'),
-            ('icon40-2.png', '40x40'),
-            ('icon40.png', '40x40'),
-            ('icon58-1.png', '58x58'),
-            ('icon58.png', '58x58'),
-            ('icon60.png', '60x60'),
-            ('icon76.png', '76x76'),
-            ('icon80-1.png', '80x80'),
-            ('icon80.png', '80x80'),
-            ('icon87.png', '87x87'),
-            ('icon-20.png', '20x20'),
-            ('icon-20@2x.png', '40x40'),
-            ('icon-20@3x.png', '60x60'),
-            ('icon-40.png', '40x40'),
-            ('icon-40@2x.png', '80x80'),
-            ('icon-50.png', '50x50'),
-            ('icon-50@2x.png', '100x100'),
-            ('icon-60@2x.png', '120x120'),
-            ('icon-60@3x.png', '180x180'),
-            ('icon-72.png', '72x72'),
-            ('icon-72@2x.png', '144x144'),
-            ('icon-76.png', '76x76'),
-            ('icon-76@2x.png', '152x152'),
-            ('icon-83.5@2x.png', '167x167'),
-            ('icon@2x.png', '114x114'),
-            ('icon-small.png', '29x29'),
-            ('icon-small@2x.png', '58x58'),
-            ('icon-small@3x.png', '87x87'),
-            ('icon-1024.png', '1024x1024')
+            ('AppIcon29x29@2x.png', 58),
+            ('AppIcon40x40@2x.png', 80),
+            ('icon.png', 57),
+            ('icon120-1.png', 120),
+            ('icon120.png', 120),
+            ('icon152.png', 152),
+            ('icon167.png', 167),
+            ('icon180.png', 180),
+            ('icon20.png', 20),
+            ('icon29-1.png', 29),
+            ('icon29.png', 29),
+            ('icon40-1.png', 40),
+            ('icon40-2.png', 40),
+            ('icon40.png', 40),
+            ('icon58-1.png', 58),
+            ('icon58.png', 58),
+            ('icon60.png', 60),
+            ('icon76.png', 76),
+            ('icon80-1.png', 80),
+            ('icon80.png', 80),
+            ('icon87.png', 87),
+            ('icon-20.png', 20),
+            ('icon-20@2x.png', 40),
+            ('icon-20@3x.png', 60),
+            ('icon-40.png', 40),
+            ('icon-40@2x.png', 80),
+            ('icon-50.png', 50),
+            ('icon-50@2x.png', 100),
+            ('icon-60@2x.png', 120),
+            ('icon-60@3x.png', 180),
+            ('icon-72.png', 72),
+            ('icon-72@2x.png', 144),
+            ('icon-76.png', 76),
+            ('icon-76@2x.png', 152),
+            ('icon-83.5@2x.png', 167),
+            ('icon@2x.png', 114),
+            ('icon-small.png', 29),
+            ('icon-small@2x.png', 58),
+            ('icon-small@3x.png', 87),
+            ('icon-1024.png', 1024)
         ]
 
-        for i in icons:
-            subprocess.run(['convert', self.config.logo_svg,
-                            '-resize', i[1],
-                            self.base_path(f'platforms/ios/Montclair/Images.xcassets/AppIcon.appiconset/{i[0]}')],
-                           check = True)
+        for (i, size) in icons:
+            images.append((Recipe.icon(size), f'platforms/ios/Montclair/Images.xcassets/AppIcon.appiconset/{i}'))
 
-        
         # create icons without transparency
-        subprocess.run(['convert', self.config.logo_svg,
-                        '-alpha', 'off',
-                        '-resize', '1024x1024',
-                        self.base_path(f'platforms/ios/Montclair/Images.xcassets/AppIcon.appiconset/icon1024-no-transparency.png')],
-                       check = True)
+        images.append((Recipe.icon(1024, alpha = False),
+                       'platforms/ios/Montclair/Images.xcassets/AppIcon.appiconset/icon1024-no-transparency.png'))
+
+        return images
 
 
     def create_splash_screen(self):
+        self.raster.write_all([(recipe, self.base_path(fname)) for (recipe, fname) in self.splash_screens()])
+
+    def splash_screens(self):
         icons = [
             ('Default-568h@2x~iphone.png', '640x1136'),
             ('Default-667h.png', '750x1134'),
@@ -269,30 +259,28 @@ class IOS:
             ('launch_image768x1024-1.png', '768x1024'),
             ('launch_image768x1024.png', '768x1024')
         ]
+        images = []
         for i in icons:
             w, h = [int(x) for x in i[1].split('x')]
-            m = min(w, h)
-
-            # our logo is sqare, so this in the new resolution
-            img = int(m / 4)
-
-            # compute the frame, divide by two, since it is on both sides
-            frame_w = (w - img) / 2
-            frame_h = (h - img) / 2
-            
-            subprocess.run(['convert', self.config.logo_svg,
-                            '-alpha', 'off',
-                            '-resize', f'{img}x{img}',
-                            '-mattecolor', 'White',
-                            '-frame', f'{frame_w}x{frame_h}',
-                            self.base_path(f'platforms/ios/Montclair/Images.xcassets/LaunchImage.launchimage/{i[0]}')],
-                           check = True)
+            images.append((Recipe.splash(w, h), f'platforms/ios/Montclair/Images.xcassets/LaunchImage.launchimage/{i[0]}'))
+
+        return images
+
+    def step(self, fn, reads, writes, fields = (), inputs = ()):
+        # reads and writes are in our tree, inputs are files from outside
+        #  of it, like the logo, relative to the current directory
+        return Step(f'IOS.{fn.__name__}', fn,
+                    tuple(self.base_path(f) for f in reads) + tuple(os.path.abspath(f) for f in inputs),
+                    tuple(self.base_path(f) for f in writes),
+                    fields)
 
     def base_path(self, fname):
         return os.path.join(self.config.build_dir, f'montclair-{self.config.repo}-pwa-ios', fname)
 
     def o(self, fname, mode = 'r'):
-        return open(self.base_path(fname), mode)
+        if self.plan:
+            return self.plan.open(self.base_path(fname), mode)
+        return self.raster.writer.open(self.base_path(fname), mode)
 
     def oread(self, fname):
         with self.o(fname) as f:
@@ -1,25 +1,86 @@
 # -*- mode: python -*-
 import sys
 import os
-import json
 import re
+import json
 import shutil
-import subprocess
+import hashlib
+
+from transmogrifier.raster import Raster, Recipe, MIME_TYPES, available
+from transmogrifier.jobs import Step
+from transmogrifier.templates import Templates
+from transmogrifier.rewrite import Rewrite
+from transmogrifier.manifest import write_manifests, web_manifest
+from transmogrifier import precache
+
+# compiled once, and shared by every tenant
+APPLE_ITUNES_APP = re.compile(r'(<meta name="apple-itunes-app" content="app-id=)\w+(">)')
+FIRST_RUN_HINT = re.compile('^(.*<div className="FirstRunHint.*)Welcome to Birmingham.*?(</div>.*)$', re.MULTILINE | re.DOTALL)
+
+# the app icons, as (name, rounded corners, sizes)
+ICONS = (
+    ('apple-icon', False, (57, 60, 72, 76, 114, 120, 144, 152, 180, 192)),
+    ('android-icon', True, (192,)),
+    ('favicon', True, (16, 32, 96)),
+    ('ms-icon', True, (144,))
+)
+
+# the icon listed in manifest.json for a size, when several have it
+MANIFEST_ICONS = ('android-icon', 'ms-icon', 'favicon', 'apple-icon')
+
+# the formats of the modern icons, smallest first, see formats()
+MODERN_FORMATS = ('avif', 'webp')
+# avif has a few hundred bytes of container overhead, which makes it
+#  larger than webp (and even png) for small icons
+MIN_SIZES = {'avif': 128}
 
 class Web:
-    def __init__(self, config):
+    def __init__(self, config, raster = None, templates = None):
         self.config = config
+        self.raster = raster or Raster(config)
+        self.templates = templates or Templates()
+        # when set, files are read from and written to the plan instead
+        self.plan = None
+        # write compressed copies and a precache manifest, see precache()
+        self.precompress = False
+        # write webp and avif copies of the icons, see formats()
+        self.modern_icons = False
 
     def go(self):
-        self.update_readme()
-        self.update_package_json()
-        self.update_manifest()
-        self.update_index()
-        self.update_first_run()
-        self.update_agency_list()
-        self.update_explore_container()
-        self.update_config()
-        self.update_icons()
+        for step in self.steps():
+            step.fn()
+        if self.precompress:
+            self.precache()
+
+    def steps(self, images = True):
+        # every step, in order, along with the files it reads and writes,
+        #  and the config fields it uses. Without images, the icons are
+        #  left to the caller, see images()
+        icons = [fname for (recipe, fname) in self.icons()]
+        steps = [
+            self.step(self.update_readme, (), ('README.md',),
+                      ('name', 'description', 'url')),
+            self.step(self.update_package_json, ('package.json', 'package-lock.json'), ('package.json', 'package-lock.json'),
+                      ('package_name',)),
+            self.step(self.update_manifest, ('public/manifest.json',), ('public/manifest.json',),
+                      ('name', 'description', 'android_config.play_store_url', 'android_config.app_id', 'ios_config.app_store_url',
+                       ('icons', self.manifest_icons() if self.modern_icons else None))),
+            self.step(self.update_index, ('public/index.html',), ('public/index.html',),
+                      ('ios_config.app_store_id', 'montclair_config.title', 'name', 'description')),
+            self.step(self.update_first_run, ('src/FirstRunHint.js',), ('src/FirstRunHint.js',),
+                      ('montclair_config.first_run_text',)),
+            self.step(self.update_agency_list, ('src/AgencyList.js',), ('src/AgencyList.js',),
+                      ('montclair_config.title', 'name')),
+            self.step(self.update_explore_container, ('src/ExploreContainer.js',), ('src/ExploreContainer.js',),
+                      ('montclair_config.title', 'name')),
+            self.step(self.update_config, (), ('src/Configuration.js',),
+                      inputs = (self.config.montclair_config.configuration_js_file,))
+        ]
+        if images:
+            steps += [
+                self.step(self.update_icons, (), icons, inputs = (self.config.logo_svg,))
+            ]
+        return steps
 
     def update_readme(self):
         with self.o('README.md', 'w') as f:
@@ -29,66 +90,66 @@ class Web:
     
     def update_package_json(self):
         # update the package.json and the package-lock.json
-        package = json.loads(self.oread('package.json'))
-        # replace the name
-        package['name'] = self.config.package_name
-        
-        with self.o('package.json', 'w') as f:
-            f.write(json.dumps(package, indent = 2))
-            f.write('\n')
+        def package(p, v):
+            # replace the name
+            p['name'] = v['package_name']
 
-        package_lock = json.loads(self.oread('package-lock.json'))
-        # replace the name
-        package_lock['name'] = self.config.package_name
-        
-        with self.o('package-lock.json', 'w') as f:
-            f.write(json.dumps(package_lock, indent = 2))
-            f.write('\n')
+        for i in ('package.json', 'package-lock.json'):
+            package_json = self.templates.json(self.oread(i), package,
+                                               {'package_name': self.config.package_name},
+                                               indent = 2)
+            with self.o(i, 'w') as f:
+                f.write(package_json)
 
     def update_manifest(self):
         # update the public/manifest.json
-        manifest = json.loads(self.oread('public/manifest.json'))
-
-        manifest['short_name'] = self.config.name
-        manifest['name'] = self.config.name
-        manifest['description'] = self.config.description
-        manifest['related_applications'] = []
-
+        related_applications = []
         if self.config.android_config:
-            manifest['related_applications'].append({
+            related_applications.append({
                 'platform': 'play',
                 'url': self.config.android_config.play_store_url,
                 'id': self.config.android_config.app_id
             })
         if self.config.ios_config:
-            manifest['related_applications'].append({
+            related_applications.append({
                 'platform': 'itunes',
                 'url': self.config.ios_config.app_store_url
             })
 
-        with self.o('public/manifest.json', 'w') as f:
-            f.write(json.dumps(manifest, indent = 4))
-            f.write('\n')
+        edit = web_manifest
+        if self.modern_icons:
+            # these only depend on Pillow, not the tenant, so they are
+            #  part of the skeleton rather than a placeholder
+            icons = self.manifest_icons()
+            srcs = set(icon['src'] for icon in icons)
+            def web_manifest_with_icons(m, v):
+                web_manifest(m, v)
+                # ours come first, followed by the template's own icons
+                #  that aren't one of ours
+                m['icons'] = icons + [icon for icon in m.get('icons', []) if icon.get('src') not in srcs]
+            edit = web_manifest_with_icons
+
+        write_manifests(self, ('public/manifest.json',), edit, {
+            'name': self.config.name,
+            'description': self.config.description,
+            'related_applications': related_applications
+        })
 
     def update_index(self):
         # replace the apple-itunes-app in the meta
         # replace the title
-        index = self.oreadlines('public/index.html')
-        with self.o('public/index.html', 'w') as f:
-            for line in index:
-                if 'apple-itunes-app' in line:
-                    r = re.compile(r'^(.*<meta name="apple-itunes-app" content="app-id=)\w+(">.*)$')
-                    matches = r.match(line)
-                    if matches:
-                        f.write(f'{matches.group(1)}{self.config.ios_config.app_store_id}{matches.group(2)}\n')
-                    else:
-                        raise Exception('Runner.Web: Unable to match apple-itunes-app in public/index.html')
-                elif '<title>Montclair</title>' in line:
-                    f.write(line.replace('Montclair', self.config.montclair_config.title or self.config.name))
-                elif '<meta name="description" content="Birmingham, AL Real Time Bus Tracker">' in line:
-                    f.write(line.replace('Birmingham, AL Real Time Bus Tracker', self.config.description))
-                else:
-                    f.write(line)
+        title = self.config.montclair_config.title or self.config.name
+        app_store_id = self.config.ios_config.app_store_id
+        Rewrite('Runner.Web').rule(
+            'public/index.html', APPLE_ITUNES_APP, lambda m: f'{m.group(1)}{app_store_id}{m.group(2)}', 1
+        ).rule(
+            'public/index.html', '<title>Montclair</title>', f'<title>{title}</title>', 1
+        ).rule(
+            'public/index.html',
+            '<meta name="description" content="Birmingham, AL Real Time Bus Tracker">',
+            f'<meta name="description" content="{self.config.description}">',
+            1
+        ).apply(self)
 
     def update_first_run(self):
         # Update src/FirstRunHint.js
@@ -96,8 +157,7 @@ class Web:
 
         first_run = self.oread('src/FirstRunHint.js')
 
-        r = re.compile('^(.*<div className="FirstRunHint.*)Welcome to Birmingham.*?(</div>.*)$', re.MULTILINE | re.DOTALL)
-        match = r.match(first_run)
+        match = FIRST_RUN_HINT.match(first_run)
         if match:
             with self.o('src/FirstRunHint.js', 'w') as f:
                 f.write(f'{match.group(1)}{self.config.montclair_config.first_run_text}{match.group(2)}')
@@ -106,93 +166,116 @@ class Web:
 
     def update_agency_list(self):
         # Update src/AgencyList.js and replace Birmingham Transit header
-        agencies = self.oreadlines('src/AgencyList.js')
-
-        with self.o('src/AgencyList.js', 'w') as f:
-            for line in agencies:
-                if 'Birmingham Transit' in line:
-                    f.write(line.replace('Birmingham Transit', self.config.montclair_config.title or self.config.name))
-                else:
-                    f.write(line)
+        Rewrite('Runner.Web').rule(
+            'src/AgencyList.js', 'Birmingham Transit', self.config.montclair_config.title or self.config.name
+        ).apply(self)
 
     def update_explore_container(self):
         # Update src/ExploreContainer.js and replace Birmingham Transit header
-        route = self.oreadlines('src/ExploreContainer.js')
-
-        with self.o('src/ExploreContainer.js', 'w') as f:
-            for line in route:
-                if 'Birmingham Transit' in line:
-                    f.write(line.replace('Birmingham Transit', self.config.montclair_config.title or self.config.name))
-                else:
-                    f.write(line)
+        Rewrite('Runner.Web').rule(
+            'src/ExploreContainer.js', 'Birmingham Transit', self.config.montclair_config.title or self.config.name
+        ).apply(self)
     
     def update_config(self):
         # replace the src/Config.js
-        shutil.copy(self.config.montclair_config.configuration_js_file, self.base_path('src/Configuration.js'))
+        with open(self.config.montclair_config.configuration_js_file, 'rb') as src, self.o('src/Configuration.js', 'wb') as f:
+            shutil.copyfileobj(src, f)
+
+    def precache(self):
+        # Runs after everything else. Writes a manifest of every file under
+        #  public/ with its hash, for the service worker, and .gz and .br
+        #  copies of the files we write there, wherever they are smaller,
+        #  so the CDN can serve them as is.
+        public = self.base_path('public')
+        entries = []
+        for (root, dirs, files) in os.walk(public):
+            dirs.sort()
+            for f in sorted(files):
+                name = os.path.relpath(os.path.join(root, f), public).replace(os.sep, '/')
+                if f.startswith('.') or f == precache.MANIFEST or f.endswith(precache.SIBLINGS):
+                    continue
+                with self.o(f'public/{name}', 'rb') as fp:
+                    data = fp.read()
+                entries.append({'url': name, 'revision': hashlib.sha256(data).hexdigest(), 'size': len(data)})
+        with self.o(f'public/{precache.MANIFEST}', 'w') as f:
+            json.dump(entries, f, indent = 2)
+            f.write('\n')
+
+        fnames = ['public/manifest.json', 'public/index.html', f'public/{precache.MANIFEST}']
+        fnames += [fname for (recipe, fname) in self.icons()]
+        self.raster.jobs.run([(fname, self.compress, (fname,)) for fname in fnames])
+
+    def compress(self, fname):
+        with self.o(fname, 'rb') as f:
+            data = f.read()
+        for (ext, compressed) in precache.compress(data):
+            if compressed is None:
+                self.remove(fname + ext)
+            else:
+                with self.o(fname + ext, 'wb') as f:
+                    f.write(compressed)
+
+    def images(self):
+        # every image as (recipe, full path)
+        return [(recipe, self.base_path(fname)) for (recipe, fname) in self.icons()]
 
     def update_icons(self):
-        # convert the logo.svg into a 512x512 png
-        subprocess.run(['convert',
-                        '-size', '512x512',
-                        'xc:none',
-                        '-fill', 'white',
-                        '-draw', 'roundRectangle 0,0 512,512 50,50',
-                        self.config.logo_svg,
-                        '-resize', '512x512',
-                        '-compose', 'SrcIn',
-                        '-composite',
-                        self.base_path('public/app-icon.png')],
-                       check = True)
-
-        # convert the logo.svg into a favicon.ico with multiple resolutions
-        subprocess.run(['convert',
-                        '-size', '256x256',
-                        'xc:none',
-                        '-fill', 'white',
-                        '-draw', 'roundRectangle 0,0 256,256 25,25',
-                        self.config.logo_svg,
-                        '-resize', '256x256',
-                        '-compose', 'SrcIn',
-                        '-composite',
-                        '-define', 'icon:auto-resize=256,192,152,144,128,96,72,64,48,32,24,16',
-                        self.base_path('public/favicon.ico')],
-                       check = True)
-
-        # create all the different app-icons
-        icons = (
-            ('apple-icon', False, (57, 60, 72, 76, 114, 120, 144, 152, 180, 192)),
-            ('android-icon', True, (192,)),
-            ('favicon', True, (16, 32, 96)),
-            ('ms-icon', True, (144,))
-        )
-        for (i, rounded_corners, sizes) in icons:
+        self.raster.write_all([(recipe, self.base_path(fname)) for (recipe, fname) in self.icons()])
+
+    def icons(self):
+        # app-icon.png 512x512 and favicon.ico with multiple resolutions
+        images = [
+            (Recipe.icon(512, rounded = True), 'public/app-icon.png'),
+            (Recipe.favicon(), 'public/favicon.ico')
+        ]
+
+        # create all the different app-icons, and their modern formats
+        for (i, rounded_corners, sizes) in ICONS:
             for size in sizes:
-                if rounded_corners:
-                    corner_ratio = 50 / 512
-                    corner_size = int(size * corner_ratio)
-                    subprocess.run(['convert',
-                                    '-size', f'{size}x{size}',
-                                    'xc:none',
-                                    '-fill', 'white',
-                                    '-draw', f'roundRectangle 0,0 {size},{size} {corner_size},{corner_size}',
-                                    self.config.logo_svg,
-                                    '-resize', f'{size}x{size}',
-                                    '-compose', 'SrcIn',
-                                    '-composite',
-                                    self.base_path(f'public/{i}-{size}x{size}.png')],
-                                   check = True)
-                else:
-                    subprocess.run(['convert',
-                                    self.config.logo_svg,
-                                    '-resize', f'{size}x{size}',
-                                    self.base_path(f'public/{i}-{size}x{size}.png')],
-                                   check = True)
+                recipe = Recipe.icon(size, rounded = rounded_corners)
+                for format in self.formats(size) + ('png',):
+                    images.append((recipe._replace(format = format), f'public/{i}-{size}x{size}.{format}'))
+
+        return images
+
+    def formats(self, size):
+        # the formats, besides png, of the icons of a size. avif only when
+        #  Pillow can encode it
+        if not self.modern_icons:
+            return ()
+        return tuple(f for f in MODERN_FORMATS if available(f) and size >= MIN_SIZES.get(f, 0))
+
+    def manifest_icons(self):
+        # every icon size, in each format with the smallest first, since
+        #  browsers use the first icon of a size whose type they support
+        names = {}
+        for (i, rounded_corners, sizes) in sorted(ICONS, key = lambda icon: MANIFEST_ICONS.index(icon[0])):
+            for size in sizes:
+                names.setdefault(size, f'{i}-{size}x{size}')
+
+        return [{'src': f'{names[size]}.{format}', 'sizes': f'{size}x{size}', 'type': MIME_TYPES[format]}
+                for size in sorted(names) for format in self.formats(size) + ('png',)]
+
+    def step(self, fn, reads, writes, fields = (), inputs = ()):
+        # reads and writes are in our tree, inputs are files from outside
+        #  of it, like the logo, relative to the current directory
+        return Step(f'Web.{fn.__name__}', fn,
+                    tuple(self.base_path(f) for f in reads) + tuple(os.path.abspath(f) for f in inputs),
+                    tuple(self.base_path(f) for f in writes),
+                    fields)
 
     def base_path(self, fname):
         return os.path.join(self.config.build_dir, f'montclair-{self.config.repo}', fname)
 
     def o(self, fname, mode = 'r'):
-        return open(self.base_path(fname), mode)
+        if self.plan:
+            return self.plan.open(self.base_path(fname), mode)
+        return self.raster.writer.open(self.base_path(fname), mode)
+
+    def remove(self, fname):
+        if self.plan:
+            return self.plan.remove(self.base_path(fname))
+        self.raster.writer.remove(self.base_path(fname))
 
     def oread(self, fname):
         with self.o(fname) as f:
@@ -0,0 +1,100 @@
+# -*- mode: python -*-
+import os
+import sys
+import errno
+import fcntl
+import shutil
+import tempfile
+
+# ioctl to clone a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+def detach(fname):
+    # Break any hardlink before fname is written to, so that writing to
+    #  a build tree never changes the template store, the image cache,
+    #  or another tenant's build tree.
+    try:
+        st = os.stat(fname)
+    except FileNotFoundError:
+        return
+
+    if st.st_nlink > 1:
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(fname))
+        os.close(fd)
+        shutil.copy2(fname, tmp)
+        os.replace(tmp, fname)
+
+class TemplateStore:
+    # A local store of the base projects, montclair, montclair-pwa-ios,
+    #  and montclair-pwa-android, keyed by version. Build trees are
+    #  materialized from the store with reflinks where the filesystem
+    #  supports them, and hardlinks otherwise. Hardlinks are broken by
+    #  detach() when a runner writes to a file.
+    def __init__(self, path):
+        self.path = path
+        self.reflink = sys.platform.startswith('linux')
+
+    def template(self, kind, version):
+        return os.path.join(self.path, kind, version)
+
+    def add(self, kind, version, src):
+        # import a checkout of a base project into the store
+        dest = self.template(kind, version)
+        tmp = dest + '.tmp'
+        shutil.rmtree(tmp, ignore_errors = True)
+        shutil.copytree(src, tmp, symlinks = True)
+        shutil.rmtree(dest, ignore_errors = True)
+        os.replace(tmp, dest)
+
+    def materialize(self, kind, version, dest):
+        # create (or recreate) the build tree dest from the template. A
+        #  marker records which template the tree came from, so an existing
+        #  tree is kept unless the version changed.
+        src = self.template(kind, version)
+        if not os.path.isdir(src):
+            raise Exception(f'TemplateStore: No {kind} {version} in {self.path}')
+
+        marker = os.path.join(os.path.dirname(dest) or '.', '.transmogrifier', os.path.basename(dest) + '.template')
+        if os.path.isdir(dest) and os.path.exists(marker):
+            with open(marker) as f:
+                if f.read().strip() == f'{kind} {version}':
+                    return False
+
+        shutil.rmtree(dest, ignore_errors = True)
+        for (root, dirs, files) in os.walk(src):
+            target = os.path.join(dest, os.path.relpath(root, src))
+            os.makedirs(target, exist_ok = True)
+            for d in dirs:
+                if os.path.islink(os.path.join(root, d)):
+                    os.symlink(os.readlink(os.path.join(root, d)), os.path.join(target, d))
+            for f in files:
+                s = os.path.join(root, f)
+                if os.path.islink(s):
+                    os.symlink(os.readlink(s), os.path.join(target, f))
+                else:
+                    self.link(s, os.path.join(target, f))
+
+        os.makedirs(os.path.dirname(marker), exist_ok = True)
+        with open(marker, 'w') as f:
+            f.write(f'{kind} {version}\n')
+        return True
+
+    def link(self, src, dest):
+        if self.reflink:
+            try:
+                with open(src, 'rb') as s, open(dest, 'wb') as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                shutil.copystat(src, dest)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                    raise
+                # no reflinks on this filesystem, don't try again
+                self.reflink = False
+                os.unlink(dest)
+
+        try:
+            os.link(src, dest)
+        except OSError:
+            # different filesystems
+            shutil.copy2(src, dest)
@@ -0,0 +1,52 @@
+# -*- mode: python -*-
+import re
+import json
+import hashlib
+import threading
+
+# placeholders are either a whole json value ("@@name@@") or part of a string
+PLACEHOLDER = re.compile(r'"@@(\w+)@@"|@@(\w+)@@')
+
+class Placeholders:
+    # Stands in for the values while a skeleton is being built
+    def __getitem__(self, name):
+        return f'@@{name}@@'
+
+class Templates:
+    # Work that is shared between every tenant built from the same
+    #  templates. Templates are identified by the hash of their contents,
+    #  so tenants whose trees came from the same version of montclair,
+    #  montclair-pwa-ios, or montclair-pwa-android share the work.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.skeletons = {}
+
+    def json(self, text, edit, values, indent = 4):
+        # Parse a json template, apply edit(document, values) and serialize
+        #  it back out. The edit is only ever applied once for a given
+        #  template, with placeholders instead of the values, and the
+        #  placeholders are filled in with the values for each tenant.
+        #  This means edit must only assign values, not inspect them.
+        key = (hashlib.sha1(text.encode('utf-8')).hexdigest(), edit.__qualname__, indent)
+        with self.lock:
+            skeleton = self.skeletons.get(key)
+        if skeleton is None:
+            document = json.loads(text)
+            edit(document, Placeholders())
+            skeleton = json.dumps(document, indent = indent) + '\n'
+            with self.lock:
+                self.skeletons[key] = skeleton
+
+        return self.fill(skeleton, values, indent)
+
+    def fill(self, skeleton, values, indent):
+        def replace(m):
+            if m.group(1):
+                # a whole value, indent it to the line it is on
+                line = skeleton[skeleton.rfind('\n', 0, m.start()) + 1:m.start()]
+                margin = line[:len(line) - len(line.lstrip())]
+                return json.dumps(values[m.group(1)], indent = indent).replace('\n', '\n' + margin)
+            # part of a string
+            return json.dumps(values[m.group(2)])[1:-1]
+
+        return PLACEHOLDER.sub(replace, skeleton)
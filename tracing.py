@@ -0,0 +1,150 @@
+# -*- mode: python -*-
+import os
+import json
+import time
+import threading
+import contextlib
+import contextvars
+import subprocess
+
+# the span being measured, the worker threads of Jobs inherit it, so
+#  images rendered for a step are charged to that step
+current = contextvars.ContextVar('span', default = None)
+
+def counters():
+    # (cpu seconds, bytes read, bytes written) of the calling thread. The
+    #  bytes are every read and write syscall, files and pipes, and are
+    #  only available on linux.
+    cpu = time.thread_time()
+    try:
+        with open('/proc/thread-self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        return (cpu, int(io['rchar']), int(io['wchar']))
+    except (OSError, KeyError, ValueError):
+        return (cpu, 0, 0)
+
+class Span:
+    # A single step of a single tenant
+    def __init__(self, name, tenant, platform):
+        self.name = name
+        self.tenant = tenant
+        self.platform = platform
+        self.start = None
+        self.tid = None
+        self.wall = 0
+        self.cpu = 0
+        self.read = 0
+        self.written = 0
+        self.processes = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self):
+        # add what the calling thread does until the block exits
+        before = counters()
+        token = current.set(self)
+        try:
+            yield
+        finally:
+            current.reset(token)
+            after = counters()
+            with self.lock:
+                self.cpu += after[0] - before[0]
+                self.read += after[1] - before[1]
+                self.written += after[2] - before[2]
+
+def propagate(fn):
+    # fn, run in another thread, but charged to the current span
+    span = current.get()
+    if span is None:
+        return fn
+
+    def run(*args):
+        with span.measure():
+            return fn(*args)
+    return run
+
+def run(args, **kwargs):
+    # subprocess.run, counted against the current span
+    span = current.get()
+    start = time.time()
+    try:
+        return subprocess.run(args, **kwargs)
+    finally:
+        if span is not None:
+            with span.lock:
+                span.processes.append((os.path.basename(args[0]), start, time.time() - start,
+                                       threading.get_ident()))
+
+class Tracer:
+    # Records wall time, cpu time, bytes read and written, and external
+    #  processes for every step. Shared by every tenant of a batch.
+    def __init__(self, fname):
+        self.fname = fname
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def wrap(self, step, tenant):
+        platform = step.name.split('.')[0]
+        return step._replace(fn = lambda: self.run(step, Span(step.name, tenant, platform)))
+
+    def run(self, step, span):
+        span.start = time.time()
+        span.tid = threading.get_ident()
+        try:
+            with span.measure():
+                step.fn()
+        finally:
+            span.wall = time.time() - span.start
+            with self.lock:
+                self.spans.append(span)
+
+    def save(self):
+        # Chrome trace event format, see chrome://tracing or ui.perfetto.dev
+        tenants = sorted(set(s.tenant for s in self.spans))
+        pids = {tenant: i + 1 for (i, tenant) in enumerate(tenants)}
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pids[t], 'args': {'name': t}} for t in tenants]
+        for s in self.spans:
+            events.append({
+                'name': s.name,
+                'cat': s.platform,
+                'ph': 'X',
+                'ts': s.start * 1e6,
+                'dur': s.wall * 1e6,
+                'pid': pids[s.tenant],
+                'tid': s.tid,
+                'args': {
+                    'tenant': s.tenant,
+                    'platform': s.platform,
+                    'cpu': s.cpu,
+                    'read': s.read,
+                    'written': s.written,
+                    'processes': len(s.processes)
+                }
+            })
+            for (name, start, wall, tid) in s.processes:
+                events.append({
+                    'name': name,
+                    'cat': 'process',
+                    'ph': 'X',
+                    'ts': start * 1e6,
+                    'dur': wall * 1e6,
+                    'pid': pids[s.tenant],
+                    'tid': tid,
+                    'args': {'step': s.name}
+                })
+
+        with open(self.fname, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        # slowest steps first
+        spans = sorted(self.spans, key = lambda s: s.wall, reverse = True)
+        width = max([len(s.name) for s in spans] + [4])
+        tenant_width = max([len(s.tenant) for s in spans] + [6])
+        print()
+        print(f'{"tenant":<{tenant_width}}  {"step":<{width}}  {"wall":>7}  {"cpu":>7}  {"read":>10}  {"written":>10}  procs')
+        for s in spans:
+            print(f'{s.tenant:<{tenant_width}}  {s.name:<{width}}  {s.wall:7.3f}  {s.cpu:7.3f}  '
+                  f'{s.read:>10}  {s.written:>10}  {len(s.processes):>5}')
+        print(f'trace written to {self.fname}')
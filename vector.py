@@ -0,0 +1,500 @@
+# -*- mode: python -*-
+import re
+import math
+import xml.etree.ElementTree as ET
+
+SVG = 'http://www.w3.org/2000/svg'
+ANDROID = 'http://schemas.android.com/apk/res/android'
+
+# elements that are drawn, and ones that never are
+SHAPES = ('path', 'rect', 'circle', 'ellipse', 'line', 'polyline', 'polygon')
+IGNORED = ('title', 'desc', 'metadata', 'defs')
+
+# presentation attributes that children inherit
+INHERITED = {
+    'fill': '#000000',
+    'fill-opacity': '1',
+    'fill-rule': 'nonzero',
+    'stroke': 'none',
+    'stroke-width': '1',
+    'stroke-opacity': '1',
+    'stroke-linecap': 'butt',
+    'stroke-linejoin': 'miter',
+    'stroke-miterlimit': '4'
+}
+
+COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0),
+    'lime': (0, 255, 0), 'green': (0, 128, 0), 'blue': (0, 0, 255),
+    'yellow': (255, 255, 0), 'cyan': (0, 255, 255), 'aqua': (0, 255, 255),
+    'magenta': (255, 0, 255), 'fuchsia': (255, 0, 255), 'gray': (128, 128, 128),
+    'grey': (128, 128, 128), 'silver': (192, 192, 192), 'maroon': (128, 0, 0),
+    'olive': (128, 128, 0), 'navy': (0, 0, 128), 'purple': (128, 0, 128),
+    'teal': (0, 128, 128), 'orange': (255, 165, 0)
+}
+
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+TRANSFORM = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+# how many numbers each path command takes
+ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7, 'Z': 0}
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+def error(message):
+    return Exception(f'VectorDrawable: {message}')
+
+def multiply(m, n):
+    # the affine transform m applied after n, both are (a, b, c, d, e, f)
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + c * B, b * A + d * B,
+            a * C + c * D, b * C + d * D,
+            a * E + c * F + e, b * E + d * F + f)
+
+def apply(m, x, y):
+    a, b, c, d, e, f = m
+    return (a * x + c * y + e, b * x + d * y + f)
+
+def numbers(text):
+    return [float(n) for n in NUMBER.findall(text)]
+
+def transform(text):
+    m = IDENTITY
+    for (name, args) in TRANSFORM.findall(text or ''):
+        v = numbers(args)
+        if name == 'matrix' and len(v) == 6:
+            t = tuple(v)
+        elif name == 'translate' and len(v) in (1, 2):
+            t = (1, 0, 0, 1, v[0], v[1] if len(v) == 2 else 0)
+        elif name == 'scale' and len(v) in (1, 2):
+            t = (v[0], 0, 0, v[1] if len(v) == 2 else v[0], 0, 0)
+        elif name == 'rotate' and len(v) in (1, 3):
+            r = math.radians(v[0])
+            t = (math.cos(r), math.sin(r), -math.sin(r), math.cos(r), 0, 0)
+            if len(v) == 3:
+                t = multiply((1, 0, 0, 1, v[1], v[2]), multiply(t, (1, 0, 0, 1, -v[1], -v[2])))
+        elif name == 'skewX' and len(v) == 1:
+            t = (1, 0, math.tan(math.radians(v[0])), 1, 0, 0)
+        elif name == 'skewY' and len(v) == 1:
+            t = (1, math.tan(math.radians(v[0])), 0, 1, 0, 0)
+        else:
+            raise error(f'Invalid transform {name}({args})')
+        m = multiply(m, t)
+    return m
+
+def length(text):
+    # a length in user units, percentages and font relative units depend
+    #  on things we don't track
+    text = text.strip()
+    if text.endswith('px'):
+        text = text[:-2]
+    try:
+        return float(text)
+    except ValueError:
+        raise error(f'Unsupported length {text!r}')
+
+def color(text):
+    # (r, g, b) or None for none
+    text = text.strip()
+    if text in ('none', 'transparent'):
+        return None
+    if re.fullmatch(r'#[0-9a-fA-F]{3}', text):
+        return tuple(int(c * 2, 16) for c in text[1:])
+    if re.fullmatch(r'#[0-9a-fA-F]{6}', text):
+        return tuple(int(text[i:i + 2], 16) for i in (1, 3, 5))
+    m = re.fullmatch(r'rgb\(([^)]*)\)', text)
+    if m:
+        parts = [p.strip() for p in m.group(1).split(',')]
+        if len(parts) == 3:
+            return tuple(round(float(p[:-1]) * 2.55) if p.endswith('%') else int(float(p)) for p in parts)
+    if text.lower() in COLORS:
+        return COLORS[text.lower()]
+    raise error(f'Unsupported color {text!r}')
+
+def arc(x1, y1, rx, ry, phi, large, sweep, x2, y2):
+    # an elliptical arc as cubic beziers [(c1x, c1y, c2x, c2y, x, y)], see
+    #  the SVG implementation notes on endpoint to center parameterization
+    if (x1, y1) == (x2, y2):
+        return []
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0:
+        return [(x1, y1, x2, y2, x2, y2)]
+
+    cos, sin = math.cos(math.radians(phi)), math.sin(math.radians(phi))
+    dx, dy = (x1 - x2) / 2, (y1 - y2) / 2
+    x1p = cos * dx + sin * dy
+    y1p = -sin * dx + cos * dy
+
+    # scale up radii that are too small to reach the end point
+    scale = (x1p / rx) ** 2 + (y1p / ry) ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+
+    num = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+    den = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+    coef = math.sqrt(max(0, num / den))
+    if large == sweep:
+        coef = -coef
+    cxp = coef * rx * y1p / ry
+    cyp = -coef * ry * x1p / rx
+    cx = cos * cxp - sin * cyp + (x1 + x2) / 2
+    cy = sin * cxp + cos * cyp + (y1 + y2) / 2
+
+    def angle(ux, uy, vx, vy):
+        return math.atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+
+    start = angle(1, 0, (x1p - cxp) / rx, (y1p - cyp) / ry)
+    delta = angle((x1p - cxp) / rx, (y1p - cyp) / ry, (-x1p - cxp) / rx, (-y1p - cyp) / ry)
+    if not sweep and delta > 0:
+        delta -= 2 * math.pi
+    elif sweep and delta < 0:
+        delta += 2 * math.pi
+
+    # at most a quarter turn per bezier
+    n = max(1, math.ceil(abs(delta) / (math.pi / 2) - 1e-9))
+    step = delta / n
+    k = 4 / 3 * math.tan(step / 4)
+
+    def point(t):
+        x, y = rx * math.cos(t), ry * math.sin(t)
+        return (cos * x - sin * y + cx, sin * x + cos * y + cy)
+
+    def tangent(t):
+        x, y = -rx * math.sin(t), ry * math.cos(t)
+        return (cos * x - sin * y, sin * x + cos * y)
+
+    curves = []
+    t = start
+    for i in range(n):
+        p1, p2 = point(t), point(t + step)
+        d1, d2 = tangent(t), tangent(t + step)
+        curves.append((p1[0] + k * d1[0], p1[1] + k * d1[1],
+                       p2[0] - k * d2[0], p2[1] - k * d2[1],
+                       p2[0], p2[1]))
+        t += step
+    # land exactly on the end point
+    curves[-1] = curves[-1][:4] + (x2, y2)
+    return curves
+
+class Scanner:
+    # reads the commands and numbers of path data, arc flags can be
+    #  written without separators (a1 1 0 01 1 1)
+    def __init__(self, d):
+        self.d = d
+        self.i = 0
+
+    def skip(self):
+        while self.i < len(self.d) and self.d[self.i] in ' \t\r\n,':
+            self.i += 1
+
+    def done(self):
+        self.skip()
+        return self.i >= len(self.d)
+
+    def command(self):
+        self.skip()
+        if self.i < len(self.d) and self.d[self.i].upper() in ARGS:
+            self.i += 1
+            return self.d[self.i - 1]
+        return None
+
+    def number(self):
+        self.skip()
+        m = NUMBER.match(self.d, self.i)
+        if m is None:
+            raise error(f'Invalid path data at {self.d[self.i:self.i + 10]!r}')
+        self.i = m.end()
+        return float(m.group())
+
+    def flag(self):
+        self.skip()
+        if self.i < len(self.d) and self.d[self.i] in '01':
+            self.i += 1
+            return self.d[self.i - 1] == '1'
+        raise error(f'Invalid arc flag at {self.d[self.i:self.i + 10]!r}')
+
+def parse_path(d):
+    # path data as absolute segments, [('M', x, y), ('L', x, y),
+    #  ('C', x1, y1, x2, y2, x, y), ('Q', x1, y1, x, y), ('Z',)]
+    s = Scanner(d)
+    segments = []
+    x = y = sx = sy = 0
+    previous = None
+    control = None
+    command = None
+    while not s.done():
+        c = s.command()
+        if c is None:
+            if command is None:
+                raise error(f'Path data must start with a command: {d[:20]!r}')
+            # repeated arguments, after a moveto they are linetos
+            c = {'M': 'L', 'm': 'l'}.get(command, command)
+        command = c
+        relative = c.islower()
+        C = c.upper()
+        ox, oy = (x, y) if relative else (0, 0)
+
+        if C == 'Z':
+            segments.append(('Z',))
+            x, y = sx, sy
+            previous = 'Z'
+            continue
+        if C == 'A':
+            rx, ry, phi = s.number(), s.number(), s.number()
+            large, sweep = s.flag(), s.flag()
+            ex, ey = s.number() + ox, s.number() + oy
+            for curve in arc(x, y, rx, ry, phi, large, sweep, ex, ey):
+                segments.append(('C',) + curve)
+            x, y = ex, ey
+            previous = 'A'
+            continue
+
+        v = [s.number() for i in range(ARGS[C])]
+        if C == 'M':
+            x, y = v[0] + ox, v[1] + oy
+            sx, sy = x, y
+            segments.append(('M', x, y))
+        elif C == 'L':
+            x, y = v[0] + ox, v[1] + oy
+            segments.append(('L', x, y))
+        elif C == 'H':
+            x = v[0] + ox
+            segments.append(('L', x, y))
+        elif C == 'V':
+            y = v[0] + oy
+            segments.append(('L', x, y))
+        elif C in ('C', 'S'):
+            if C == 'S':
+                # reflect the previous control point
+                c1 = (2 * x - control[0], 2 * y - control[1]) if previous in ('C', 'S') else (x, y)
+                v = list(c1) + [v[0] + ox, v[1] + oy, v[2] + ox, v[3] + oy]
+            else:
+                v = [v[0] + ox, v[1] + oy, v[2] + ox, v[3] + oy, v[4] + ox, v[5] + oy]
+            segments.append(('C',) + tuple(v))
+            control = (v[2], v[3])
+            x, y = v[4], v[5]
+        elif C in ('Q', 'T'):
+            if C == 'T':
+                c1 = (2 * x - control[0], 2 * y - control[1]) if previous in ('Q', 'T') else (x, y)
+                v = list(c1) + [v[0] + ox, v[1] + oy]
+            else:
+                v = [v[0] + ox, v[1] + oy, v[2] + ox, v[3] + oy]
+            segments.append(('Q',) + tuple(v))
+            control = (v[0], v[1])
+            x, y = v[2], v[3]
+        previous = C
+    return segments
+
+def rect_path(x, y, w, h, rx, ry):
+    if not rx and not ry:
+        return f'M{x},{y}H{x + w}V{y + h}H{x}Z'
+    rx = min(rx or ry, w / 2)
+    ry = min(ry or rx, h / 2)
+    return (f'M{x + rx},{y}H{x + w - rx}A{rx},{ry} 0 0 1 {x + w},{y + ry}'
+            f'V{y + h - ry}A{rx},{ry} 0 0 1 {x + w - rx},{y + h}'
+            f'H{x + rx}A{rx},{ry} 0 0 1 {x},{y + h - ry}'
+            f'V{y + ry}A{rx},{ry} 0 0 1 {x + rx},{y}Z')
+
+def ellipse_path(cx, cy, rx, ry):
+    return (f'M{cx + rx},{cy}A{rx},{ry} 0 0 1 {cx},{cy + ry}A{rx},{ry} 0 0 1 {cx - rx},{cy}'
+            f'A{rx},{ry} 0 0 1 {cx},{cy - ry}A{rx},{ry} 0 0 1 {cx + rx},{cy}Z')
+
+def shape_path(tag, e):
+    # the path data of a basic shape, or None if it isn't drawn
+    def attr(name, default = '0'):
+        return length(e.get(name, default))
+
+    if tag == 'path':
+        return e.get('d') or None
+    if tag == 'rect':
+        w, h = attr('width'), attr('height')
+        if w <= 0 or h <= 0:
+            return None
+        rx, ry = e.get('rx'), e.get('ry')
+        return rect_path(attr('x'), attr('y'), w, h,
+                         length(rx) if rx else None, length(ry) if ry else None)
+    if tag == 'circle':
+        r = attr('r')
+        return ellipse_path(attr('cx'), attr('cy'), r, r) if r > 0 else None
+    if tag == 'ellipse':
+        rx, ry = attr('rx'), attr('ry')
+        return ellipse_path(attr('cx'), attr('cy'), rx, ry) if rx > 0 and ry > 0 else None
+    if tag == 'line':
+        return f'M{attr("x1")},{attr("y1")}L{attr("x2")},{attr("y2")}'
+
+    # polyline and polygon
+    v = numbers(e.get('points', ''))
+    if len(v) < 4:
+        return None
+    points = 'L'.join(f'{v[i]},{v[i + 1]}' for i in range(0, len(v) - 1, 2))
+    return f'M{points}' + ('Z' if tag == 'polygon' else '')
+
+class Converter:
+    # Converts an SVG into the paths of an Android VectorDrawable. Every
+    #  shape becomes absolute path data with its transforms applied, since
+    #  a VectorDrawable group can't skew. Anything that can't be expressed
+    #  (gradients, text, images, masks, CSS) raises.
+    def __init__(self, data):
+        try:
+            self.root = ET.fromstring(data)
+        except ET.ParseError as e:
+            raise error(f'Unable to parse the svg: {e}')
+        if self.root.tag != f'{{{SVG}}}svg':
+            raise error('Not an svg document')
+        self.paths = []
+
+        viewbox = numbers(self.root.get('viewBox', ''))
+        if len(viewbox) == 4:
+            (self.x, self.y, self.width, self.height) = viewbox
+        elif self.root.get('width') and self.root.get('height'):
+            (self.x, self.y) = (0, 0)
+            self.width = length(self.root.get('width'))
+            self.height = length(self.root.get('height'))
+        else:
+            raise error('The svg needs a viewBox, or a width and height')
+        if self.width <= 0 or self.height <= 0:
+            raise error('The svg has no area')
+
+    def convert(self):
+        # like the raster icons, the logo is scaled to fit a square, in
+        #  the top left corner
+        self.size = max(self.width, self.height)
+        # the presentation attributes of the <svg> are inherited like a <g>'s
+        style = self.style(self.root, dict(INHERITED))
+        if style.pop('display', None) != 'none':
+            self.walk(self.root, style, float(style.pop('opacity', 1)), (1, 0, 0, 1, -self.x, -self.y))
+        return self
+
+    def style(self, e, inherited):
+        style = dict(inherited)
+        for (k, v) in e.attrib.items():
+            if k in INHERITED or k in ('opacity', 'display', 'visibility', 'clip-path', 'mask', 'filter'):
+                style[k] = v
+        for declaration in e.get('style', '').split(';'):
+            if ':' in declaration:
+                k, v = (p.strip() for p in declaration.split(':', 1))
+                style[k] = v
+        for k in ('clip-path', 'mask', 'filter'):
+            if style.get(k, 'none') != 'none':
+                raise error(f'{k} is not supported')
+        return style
+
+    def walk(self, e, inherited, opacity, m):
+        for child in e:
+            if not isinstance(child.tag, str) or not child.tag.startswith(f'{{{SVG}}}'):
+                # comments, and other namespaces like inkscape's
+                continue
+            tag = child.tag[len(SVG) + 2:]
+            if tag in IGNORED:
+                continue
+
+            style = self.style(child, inherited)
+            if style.pop('display', None) == 'none':
+                continue
+            o = opacity * float(style.pop('opacity', 1))
+            t = multiply(m, transform(child.get('transform')))
+            if tag == 'g':
+                self.walk(child, style, o, t)
+            elif tag in SHAPES:
+                if style.pop('visibility', 'visible') in ('hidden', 'collapse'):
+                    continue
+                d = shape_path(tag, child)
+                if d:
+                    self.add(d, style, o, t, tag)
+            else:
+                raise error(f'<{tag}> is not supported')
+
+    def add(self, d, style, opacity, m, tag):
+        segments = []
+        for segment in parse_path(d):
+            points = segment[1:]
+            transformed = []
+            for i in range(0, len(points), 2):
+                transformed += apply(m, points[i], points[i + 1])
+            segments.append((segment[0],) + tuple(transformed))
+
+        for k in ('fill', 'stroke'):
+            if style[k].startswith('url('):
+                raise error('Gradients and patterns are not supported')
+        # a line has nothing inside of it to fill
+        fill = color(style['fill']) if tag != 'line' else None
+        stroke = color(style['stroke'])
+        if fill is None and stroke is None:
+            return
+        # stroke widths scale with the transform
+        scale = math.sqrt(abs(m[0] * m[3] - m[1] * m[2]))
+        self.paths.append({
+            'segments': segments,
+            'fill': fill,
+            'fill_alpha': opacity * float(style['fill-opacity']),
+            'fill_rule': style['fill-rule'],
+            'stroke': stroke,
+            'stroke_alpha': opacity * float(style['stroke-opacity']),
+            'stroke_width': length(style['stroke-width']) * scale,
+            'linecap': style['stroke-linecap'],
+            'linejoin': style['stroke-linejoin'],
+            'miterlimit': float(style['stroke-miterlimit'])
+        })
+
+def number(v, digits):
+    s = f'{v:.{digits}f}'.rstrip('0').rstrip('.') if digits else str(round(v))
+    return '0' if s in ('', '-0') else s
+
+def path_data(segments, digits):
+    parts = []
+    for segment in segments:
+        parts.append(segment[0] + ','.join(number(v, digits) for v in segment[1:]))
+    return ' '.join(parts)
+
+def argb(rgb, alpha, monochrome):
+    # monochrome layers are only used for their alpha
+    r, g, b = (255, 255, 255) if monochrome else rgb
+    a = round(max(0, min(1, alpha)) * 255)
+    return f'#{a:02X}{r:02X}{g:02X}{b:02X}'
+
+def element(tag, attrs, indent, children = None):
+    # android xml style, an attribute per line
+    pad = ' ' * indent
+    lines = [f'{pad}<{tag}'] + [f'{pad}    android:{k}="{v}"' for (k, v) in attrs]
+    if not children:
+        return '\n'.join(lines) + ' />\n'
+    return '\n'.join(lines) + '>\n' + ''.join(children) + f'{pad}</{tag}>\n'
+
+def vector_drawable(data, corners = 0, dp = 108, monochrome = False):
+    # An Android VectorDrawable of an svg, dp wide and tall, clipped to
+    #  a rounded square with a radius of corners times its size
+    c = Converter(data).convert()
+    size = c.size
+    # keep about 4 significant digits, whatever the scale of the viewport
+    digits = max(0, 4 - math.floor(math.log10(size)))
+    indent = 8 if corners else 4
+
+    paths = []
+    for p in c.paths:
+        attrs = []
+        if p['fill'] is not None:
+            attrs.append(('fillColor', argb(p['fill'], p['fill_alpha'], monochrome)))
+            if p['fill_rule'] == 'evenodd':
+                attrs.append(('fillType', 'evenOdd'))
+        if p['stroke'] is not None and p['stroke_width'] > 0:
+            attrs.append(('strokeColor', argb(p['stroke'], p['stroke_alpha'], monochrome)))
+            attrs.append(('strokeWidth', number(p['stroke_width'], digits)))
+            if p['linecap'] != 'butt':
+                attrs.append(('strokeLineCap', p['linecap']))
+            if p['linejoin'] != 'miter':
+                attrs.append(('strokeLineJoin', p['linejoin']))
+            if p['miterlimit'] != 4:
+                attrs.append(('strokeMiterLimit', number(p['miterlimit'], 2)))
+        if attrs:
+            paths.append(element('path', attrs + [('pathData', path_data(p['segments'], digits))], indent))
+
+    if corners:
+        clip = rect_path(0, 0, size, size, size * corners, size * corners)
+        paths = [element('group', [], 4, [element('clip-path', [('pathData', path_data(parse_path(clip), digits))], 8)] + paths)]
+
+    return ('<?xml version="1.0" encoding="utf-8"?>\n' +
+            element('vector', [('width', f'{dp}dp'),
+                               ('height', f'{dp}dp'),
+                               ('viewportWidth', number(size, digits)),
+                               ('viewportHeight', number(size, digits))], 0, paths)
+            .replace('<vector\n', f'<vector xmlns:android="{ANDROID}"\n', 1))
@@ -0,0 +1,243 @@
+# -*- mode: python -*-
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+import contextlib
+import concurrent.futures
+
+from transmogrifier.config import load_config, config_to_dict, config_from_dict
+from transmogrifier.batch import Batch
+
+# states of a job
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = '''
+create table if not exists jobs (
+    tenant text primary key,
+    config text not null,
+    state text not null,
+    attempts integer not null default 0,
+    worker text,
+    lease_until real,
+    enqueued real not null
+);
+create table if not exists results (
+    tenant text not null,
+    attempt integer not null,
+    worker text not null,
+    status text not null,
+    error text,
+    started real not null,
+    elapsed real not null
+);
+'''
+
+class WorkQueue:
+    # A durable queue of tenant builds in a SQLite database, which can be
+    #  shared by worker processes on one host, or on several hosts with
+    #  a shared filesystem (one that supports locking). Each job is a
+    #  tenant's serialized Config.
+    #
+    #  A worker leases a job for a while, and keeps renewing the lease as
+    #  long as it is building. If the worker dies, its lease runs out and
+    #  another worker picks the job up again, up to max_attempts times.
+    #  A build that raises isn't retried, it would fail the same way.
+    #  Every attempt is recorded in the results table.
+    def __init__(self, fname, lease = 60, max_attempts = 3):
+        self.fname = fname
+        self.lease = lease
+        self.max_attempts = max_attempts
+        db = sqlite3.connect(self.fname, timeout = 60)
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # a new connection every time, so any thread can use the queue.
+        #  begin immediate takes the write lock up front, so two workers
+        #  can't claim the same job
+        db = sqlite3.connect(self.fname, timeout = 60, isolation_level = None)
+        try:
+            db.execute('begin immediate')
+            try:
+                yield db
+            except BaseException:
+                db.execute('rollback')
+                raise
+            db.execute('commit')
+        finally:
+            db.close()
+
+    def enqueue(self, configs):
+        # configs is either a list of Config, or a directory of tenant
+        #  .json files. A tenant that is already queued is replaced, and
+        #  starts over. Nothing is queued if any of them fail to load.
+        if isinstance(configs, str):
+            path = configs
+            configs = []
+            for fname in sorted(os.listdir(path)):
+                if not fname.endswith('.json'):
+                    continue
+                try:
+                    configs.append(load_config(os.path.join(path, fname)))
+                except Exception as e:
+                    raise Exception(f'WorkQueue: Unable to load {fname}: {e}')
+
+        now = time.time()
+        with self.transaction() as db:
+            for config in configs:
+                db.execute('insert or replace into jobs (tenant, config, state, enqueued) values (?, ?, ?, ?)',
+                           (config.repo, json.dumps(config_to_dict(config)), PENDING, now))
+        return len(configs)
+
+    def claim(self, worker):
+        # lease the next job, returns (tenant, config, attempt), or None
+        #  if there is nothing to do right now
+        now = time.time()
+        with self.transaction() as db:
+            # jobs whose worker died and have no attempts left
+            for (tenant, attempts, w) in db.execute(
+                    'select tenant, attempts, worker from jobs where state = ? and lease_until < ? and attempts >= ?',
+                    (LEASED, now, self.max_attempts)).fetchall():
+                db.execute('update jobs set state = ?, worker = null, lease_until = null where tenant = ?',
+                           (FAILED, tenant))
+                db.execute('insert into results values (?, ?, ?, ?, ?, ?, ?)',
+                           (tenant, attempts, w, FAILED, 'WorkQueue: Lease expired', now, 0))
+
+            row = db.execute('select tenant, config, attempts from jobs '
+                             'where state = ? or (state = ? and lease_until < ?) '
+                             'order by enqueued, tenant limit 1',
+                             (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+
+            (tenant, config, attempts) = row
+            db.execute('update jobs set state = ?, attempts = ?, worker = ?, lease_until = ? where tenant = ?',
+                       (LEASED, attempts + 1, worker, now + self.lease, tenant))
+        return (tenant, config_from_dict(json.loads(config)), attempts + 1)
+
+    def renew(self, worker, tenants):
+        # extend the leases a worker still holds
+        with self.transaction() as db:
+            for tenant in tenants:
+                db.execute('update jobs set lease_until = ? where tenant = ? and worker = ? and state = ?',
+                           (time.time() + self.lease, tenant, worker, LEASED))
+
+    def complete(self, worker, tenant, attempt, result, started):
+        # record the result of an attempt, returns False if the lease had
+        #  already run out and the job was given to another worker
+        status = FAILED if result.error else DONE
+        error = str(result.error) if result.error else None
+        with self.transaction() as db:
+            db.execute('insert into results values (?, ?, ?, ?, ?, ?, ?)',
+                       (tenant, attempt, worker, status, error, started, result.elapsed))
+            c = db.execute('update jobs set state = ?, worker = null, lease_until = null '
+                           'where tenant = ? and worker = ? and state = ?',
+                           (status, tenant, worker, LEASED))
+            return c.rowcount == 1
+
+    def pending(self):
+        # the number of jobs that are not finished yet
+        with self.transaction() as db:
+            return db.execute('select count(*) from jobs where state in (?, ?)', (PENDING, LEASED)).fetchone()[0]
+
+    def status(self):
+        # [(tenant, state, attempts, worker, error, elapsed)], with the
+        #  error and elapsed time of the latest attempt
+        with self.transaction() as db:
+            return db.execute('select j.tenant, j.state, j.attempts, r.worker, r.error, r.elapsed from jobs j '
+                              'left join results r on r.rowid = '
+                              '(select max(rowid) from results where tenant = j.tenant) '
+                              'order by j.tenant').fetchall()
+
+    def report(self):
+        rows = self.status()
+        width = max([len(r[0]) for r in rows] + [6])
+        print(f'{"tenant":<{width}}  {"state":<7}  attempts  seconds  worker')
+        for (tenant, state, attempts, worker, error, elapsed) in rows:
+            elapsed = f'{elapsed:7.1f}' if elapsed is not None else ''
+            print(f'{tenant:<{width}}  {state:<7}  {attempts:>8}  {elapsed:>7}  {worker or ""}')
+            for line in (error or '').splitlines():
+                print(f'{"":<{width}}    {line}')
+
+class Worker(Batch):
+    # Builds tenants from a WorkQueue, until it is empty. Any number of
+    #  workers can run at the same time, each building up to tenants jobs
+    #  at once, and sharing the worker pool, image cache, and templates
+    #  between them like a Batch.
+    def __init__(self, queue, tenants = 4):
+        super().__init__(None, tenants)
+        self.queue = queue
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        # whether to wait for the jobs other workers are building, in case
+        #  they die and the jobs need to be retried
+        self.wait = True
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def parse_args(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--lease', type = int, default = self.queue.lease,
+                            help = f'Seconds a job is leased for, before another worker retries it (default: {self.queue.lease})')
+        parser.add_argument('--no-wait', action = 'store_true',
+                            help = 'Exit once no jobs are pending, instead of waiting for leased jobs')
+        args = super().parse_args(parser)
+        self.queue.lease = args.lease
+        self.wait = not args.no_wait
+
+    def build(self):
+        self.start = time.time()
+        done = threading.Event()
+        heartbeat = threading.Thread(target = self.heartbeat, args = (done,), daemon = True)
+        heartbeat.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.tenants) as pool:
+                for results in pool.map(lambda i: self.work(), range(self.tenants)):
+                    self.results += results
+        finally:
+            done.set()
+            heartbeat.join()
+
+        self.elapsed = time.time() - self.start
+        return self.results
+
+    def work(self):
+        results = []
+        while True:
+            job = self.queue.claim(self.name)
+            if job is None:
+                if self.wait and self.queue.pending():
+                    time.sleep(min(self.queue.lease / 4, 5))
+                    continue
+                return results
+
+            (tenant, config, attempt) = job
+            with self.lock:
+                self.active.add(tenant)
+            started = time.time()
+            try:
+                result = self.build_tenant(tenant, config)
+            finally:
+                with self.lock:
+                    self.active.discard(tenant)
+            if not self.queue.complete(self.name, tenant, attempt, result, started):
+                print(f'{tenant}: lease ran out, another worker is building it', file = sys.stderr)
+            results.append(result)
+
+    def heartbeat(self, done):
+        while not done.wait(self.queue.lease / 3):
+            with self.lock:
+                tenants = list(self.active)
+            if tenants:
+                self.queue.renew(self.name, tenants)
@@ -0,0 +1,152 @@
+# -*- mode: python -*-
+import io
+import os
+import shutil
+import secrets
+import threading
+
+class Output(io.BytesIO):
+    # a file being written, it is only written out when closed
+    def __init__(self, writer, fname):
+        super().__init__()
+        self.writer = writer
+        self.fname = fname
+
+    def close(self):
+        if not self.closed:
+            self.writer.write(self.fname, self.getvalue())
+        super().close()
+
+class Writer:
+    # Writes files only when their contents change, so files that come out
+    #  the same keep their mtime, and npm, Gradle, and Xcode don't rebuild
+    #  them. Changed files are written to a temporary file and renamed over
+    #  the old one, which also never writes through a hardlink into the
+    #  template store or the image cache.
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        # files that are read from somewhere else until they are written,
+        #  see Ledger.restore
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.written = 0
+            self.skipped = 0
+
+    def redirect(self, fname, source):
+        with self.lock:
+            self.sources[fname] = source
+
+    def release(self, fnames):
+        # stop redirecting fnames, returns {fname: source} of the ones
+        #  that weren't written
+        with self.lock:
+            return {fname: self.sources.pop(fname) for fname in fnames if fname in self.sources}
+
+    def open(self, fname, mode = 'r'):
+        # the same as open(fname, mode), for the modes the runners use
+        if 'r' in mode:
+            with self.lock:
+                source = self.sources.get(fname, fname)
+            return open(source, mode)
+        f = Output(self, fname)
+        return f if 'b' in mode else io.TextIOWrapper(f, encoding = 'utf-8')
+
+    def same(self, fname, data):
+        try:
+            if os.path.getsize(fname) != len(data):
+                return False
+            with open(fname, 'rb') as f:
+                return f.read() == data
+        except FileNotFoundError:
+            return False
+
+    def write(self, fname, data):
+        # returns False if fname already had these contents
+        with self.lock:
+            self.sources.pop(fname, None)
+        if self.same(fname, data):
+            self.count(False)
+            return False
+
+        self.replace(fname, lambda tmp: self.save(tmp, data))
+        self.count(True)
+        return True
+
+    def link(self, src, fname):
+        # hardlink (or copy) src to fname, unless it is already the same
+        try:
+            if os.path.samefile(src, fname):
+                self.count(False)
+                return False
+        except FileNotFoundError:
+            pass
+        if os.path.isfile(fname) and os.path.getsize(src) == os.path.getsize(fname):
+            with open(src, 'rb') as f:
+                if self.same(fname, f.read()):
+                    self.count(False)
+                    return False
+
+        def link(tmp):
+            os.unlink(tmp)
+            try:
+                os.link(src, tmp)
+            except OSError:
+                # different filesystems, or no hardlink support
+                shutil.copyfile(src, tmp)
+        self.replace(fname, link)
+        self.count(True)
+        return True
+
+    def remove(self, fname):
+        # returns False if there was nothing to remove
+        with self.lock:
+            self.sources.pop(fname, None)
+        try:
+            os.unlink(fname)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def replace(self, fname, create):
+        # create(tmp) makes the new file, which then replaces fname
+        os.makedirs(os.path.dirname(fname), exist_ok = True)
+        tmp = self.temporary(fname)
+        try:
+            create(tmp)
+            if not os.path.islink(tmp) and os.stat(tmp).st_nlink == 1:
+                try:
+                    os.chmod(tmp, os.stat(fname).st_mode & 0o7777)
+                except FileNotFoundError:
+                    # a new file keeps the permissions it was created with
+                    pass
+            os.replace(tmp, fname)
+        except BaseException:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def temporary(self, fname):
+        # an empty file next to fname, like mkstemp, but created with the
+        #  permissions open() would give it (0o666 less the umask)
+        while True:
+            tmp = os.path.join(os.path.dirname(fname), f'.{os.path.basename(fname)}{secrets.token_hex(4)}')
+            try:
+                os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+                return tmp
+            except FileExistsError:
+                pass
+
+    def save(self, tmp, data):
+        with open(tmp, 'wb') as f:
+            f.write(data)
+
+    def count(self, written):
+        with self.lock:
+            if written:
+                self.written += 1
+            else:
+                self.skipped += 1
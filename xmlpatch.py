@@ -0,0 +1,188 @@
+# -*- mode: python -*-
+import re
+import collections
+import xml.parsers.expat
+import xml.etree.ElementTree as ET
+
+WIDGETS = 'http://www.w3.org/ns/widgets'
+CORDOVA = 'http://cordova.apache.org/ns/1.0'
+ANDROID = 'http://schemas.android.com/apk/res/android'
+
+# register the namespaces once, so a rewritten tree keeps the usual prefixes
+# See: https://stackoverflow.com/questions/3895951/create-svg-xml-document-without-ns0-namespace-using-python-elementtree
+ET.register_namespace('', WIDGETS)
+ET.register_namespace('cdv', CORDOVA)
+ET.register_namespace('android', ANDROID)
+
+# an attribute in a start tag
+ATTRIBUTE = re.compile(rb'\s([^\s=/>]+)\s*=\s*(["\'])(.*?)\2', re.DOTALL)
+
+# An edit to a document. path is an ElementTree path from the root,
+#  attr is the attribute to set, or None to set the text of the element.
+Edit = collections.namedtuple('Edit', ('path', 'attr', 'value', 'required'))
+
+class Document:
+    # An ElementTree parsed with expat, which also records where each
+    #  element starts in the original bytes, so it can be patched in place.
+    def __init__(self, data):
+        self.data = data
+        self.positions = {}
+        self.namespaces = {}
+        self.root = None
+
+        stack = []
+        parser = xml.parsers.expat.ParserCreate(namespace_separator = '}')
+        parser.buffer_text = True
+
+        def name(n):
+            return '{' + n if '}' in n else n
+
+        def start(tag, attrs):
+            element = ET.Element(name(tag), {name(k): v for (k, v) in attrs.items()})
+            self.positions[element] = parser.CurrentByteIndex
+            if stack:
+                stack[-1].append(element)
+            else:
+                self.root = element
+            stack.append(element)
+
+        def end(tag):
+            stack.pop()
+
+        def text(t):
+            parent = stack[-1]
+            if len(parent):
+                parent[-1].tail = (parent[-1].tail or '') + t
+            else:
+                parent.text = (parent.text or '') + t
+
+        def namespace(prefix, uri):
+            if self.namespaces.setdefault(uri, prefix) != prefix:
+                # the same namespace with more than one prefix
+                self.namespaces[uri] = False
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+        parser.StartNamespaceDeclHandler = namespace
+        parser.Parse(data, True)
+
+    def start_tag(self, element):
+        # (start, end) of the element's start tag, end is just after the '>'
+        start = self.positions[element]
+        quote = None
+        for i in range(start, len(self.data)):
+            c = self.data[i:i + 1]
+            if quote:
+                if c == quote:
+                    quote = None
+            elif c in (b'"', b"'"):
+                quote = c
+            elif c == b'>':
+                return (start, i + 1)
+
+    def patch_attr(self, element, attr, value):
+        # returns (start, end, bytes) to set an attribute, or None
+        start, end = self.start_tag(element)
+        tag = self.data[start:end]
+        if attr.startswith('{'):
+            uri, local = attr[1:].split('}')
+            prefix = self.namespaces.get(uri)
+            if not prefix:
+                return None
+            qname = f'{prefix}:{local}'
+        else:
+            qname = attr
+
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('\n', '&#10;')
+        for m in ATTRIBUTE.finditer(tag):
+            if m.group(1).decode('utf-8') == qname:
+                quote = m.group(2).decode('utf-8')
+                value = value.replace(quote, '&quot;' if quote == '"' else '&apos;')
+                return (start + m.start(3), start + m.end(3), value.encode('utf-8'))
+
+        # add it to the end of the start tag, before any whitespace there
+        close = end - 2 if tag.endswith(b'/>') else end - 1
+        while self.data[close - 1:close].isspace():
+            close -= 1
+        value = value.replace('"', '&quot;')
+        return (close, close, f' {qname}="{value}"'.encode('utf-8'))
+
+    def patch_text(self, element, value):
+        # returns (start, end, bytes) to set the text of an element, or None
+        start, end = self.start_tag(element)
+        if self.data[start:end].endswith(b'/>'):
+            return None
+        close = self.data.find(b'<', end)
+        if close < 0 or self.data[close + 1:close + 2] in (b'!', b'?'):
+            # comments or CDATA, let the tree handle it
+            return None
+
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        return (end, close, value.encode('utf-8'))
+
+class XMLPatch:
+    # Applies attribute and text edits to XML documents. Every distinct
+    #  document is parsed once. When all the edits are simple replacements
+    #  they are patched into the original bytes, which keeps the formatting,
+    #  comments, and namespace prefixes. Otherwise the tree is rewritten.
+    def __init__(self, name):
+        self.name = name
+        self.edits = []
+
+    def attr(self, path, attr, value, required = True):
+        self.edits.append(Edit(path, attr, value, required))
+        return self
+
+    def text(self, path, value, required = True):
+        self.edits.append(Edit(path, None, value, required))
+        return self
+
+    def apply(self, runner, fnames):
+        # group identical copies, so each is only parsed and patched once
+        documents = {}
+        for fname in fnames:
+            with runner.o(fname, 'rb') as f:
+                documents.setdefault(f.read(), []).append(fname)
+
+        for (data, copies) in documents.items():
+            output = self.patch(data, copies[0])
+            for fname in copies:
+                with runner.o(fname, 'wb') as f:
+                    f.write(output)
+
+    def patch(self, data, fname):
+        document = Document(data)
+        utf8 = re.match(rb'<\?xml[^>]*encoding=["\'](?!utf-?8["\'])', data, re.IGNORECASE) is None
+
+        patches = []
+        for edit in self.edits:
+            element = document.root if edit.path == '.' else document.root.find(edit.path)
+            if element is None:
+                if edit.required:
+                    raise Exception(f'{self.name}: Unable to find {edit.path} in {fname}')
+                continue
+
+            # update the tree, in case we can't patch the bytes
+            if edit.attr:
+                element.set(edit.attr, edit.value)
+            else:
+                element.text = edit.value
+
+            if patches is not None and utf8:
+                if edit.attr:
+                    p = document.patch_attr(element, edit.attr, edit.value)
+                else:
+                    p = document.patch_text(element, edit.value)
+                patches = patches + [p] if p else None
+
+        if patches is not None and utf8:
+            patches.sort()
+            if all(a[1] <= b[0] for (a, b) in zip(patches, patches[1:])):
+                output = data
+                for (start, end, value) in reversed(patches):
+                    output = output[:start] + value + output[end:]
+                return output
+
+        # write out the whole tree
+        return ET.tostring(document.root, encoding = 'utf-8', xml_declaration = True)